@@ -0,0 +1,59 @@
+"""
+Per-call overhead of execute_update / execute_delete / execute_create with and without the statement cache
+
+    python benchmarks/bench_statement_cache.py
+"""
+from sqlalchemy import text
+
+from common import bench, create_app
+
+from flask_sql_pro import DataBaseHelper
+
+WHERE = {'id': 1, 'age__gte': 18, 'name__like': 'a%'}
+EXCLUDE = {'score__isnull': True}
+DATA = {'name': 'a', 'age': 20, 'score': 1.5}
+
+
+def build_update_sql():
+    sql = DataBaseHelper.get_update_sql('user', DATA.keys())
+    sql = DataBaseHelper.set_where_phrase(sql, WHERE)
+    return DataBaseHelper.set_exclude_phrase(sql, EXCLUDE)
+
+
+def build_update():
+    return text(build_update_sql())
+
+
+def cached_update():
+    keys = tuple(DATA.keys())
+    return DataBaseHelper.get_statement(
+        ('update', 'user', keys, DataBaseHelper.condition_shape(WHERE), DataBaseHelper.condition_shape(EXCLUDE)),
+        build_update_sql,
+    )
+
+
+def main():
+    create_app()
+    DataBaseHelper.execute_create_many('user', [{'name': 'a', 'age': 20, 'score': 1.0}] * 100, commit=True)
+    calls = {
+        'update': lambda: DataBaseHelper.execute_update('user', dict(DATA), WHERE, exclude=EXCLUDE),
+        'delete': lambda: DataBaseHelper.execute_delete('user', {'id': 1000}),
+        'create': lambda: DataBaseHelper.execute_create('user', dict(DATA)),
+    }
+
+    print('%-28s %12s' % ('case', 'us/call'))
+    print('%-28s %12.2f' % ('build update sql', bench(build_update, 5000)))
+    print('%-28s %12.2f' % ('cached update statement', bench(cached_update, 5000)))
+    for name, call in calls.items():
+        DataBaseHelper.statement_cache.resize(0)
+        uncached = bench(call, 500)
+        DataBaseHelper.rollback()
+        DataBaseHelper.statement_cache.resize(1024)
+        cached = bench(call, 500)
+        DataBaseHelper.rollback()
+        print('%-28s %12.2f' % ('execute_%s uncached' % name, uncached))
+        print('%-28s %12.2f' % ('execute_%s cached' % name, cached))
+
+
+if __name__ == '__main__':
+    main()
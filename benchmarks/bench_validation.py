@@ -0,0 +1,49 @@
+"""
+SQL-injection validation of fullfilled_data: keyword scan of every key and value (previous implementation)
+against identifier-only validation with a precompiled regex
+
+    python benchmarks/bench_validation.py
+"""
+from common import bench
+
+from flask_sql_pro import DataBaseHelper
+
+KEYWORDS = ['DROP', 'SELECT', 'DELETE' 'UPDATE', 'INSERT', 'EXEC', '--', '/*', '*/', 'xp_', 'sp_']
+
+
+def legacy_check_sql_injection(k, v):
+    if any(keyword in str(k).upper() for keyword in KEYWORDS):
+        raise ValueError('Keywords that may be at risk for SQL injection in key: ' + str(k))
+    if any(keyword in str(v).upper() for keyword in KEYWORDS):
+        raise ValueError('Keywords that may be at risk for SQL injection in value: ' + str(v))
+
+
+def legacy_fullfilled_data(data, where):
+    for k, v in where.items():
+        legacy_check_sql_injection(k, v)
+        _d = DataBaseHelper.handle_range_type(k, v)
+        if _d:
+            data.update(**_d)
+            continue
+        data.update(**{"_where_%s" % k: v})
+    return data
+
+
+CASES = {
+    'small where': {'id': 1, 'status': 2, 'name__like': 'abc%'},
+    '__in 10k ids': {'id__in': list(range(10000))},
+    'long text 64KB': {'content': 'lorem ipsum ' * 5460},
+}
+
+
+def main():
+    print('%-20s %14s %14s %8s' % ('case', 'legacy us', 'current us', 'speedup'))
+    for name, where in CASES.items():
+        number = 10000 if name == 'small where' else 200
+        legacy = bench(lambda: legacy_fullfilled_data({}, where), number)
+        current = bench(lambda: DataBaseHelper.fullfilled_data({}, where), number)
+        print('%-20s %14.2f %14.2f %7.1fx' % (name, legacy, current, legacy / current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Shared setup of the benchmarks: a Flask app on a local SQLite file with a generated sql catalog
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from flask_sql_pro import FlaskSQLPro  # noqa: E402
+
+USER_SQL = """
+select_all: |
+    SELECT id, name, age, score FROM user
+    WHERE 1=1
+    {% if min_age %}
+    AND age >= :min_age
+    {% endif %}
+    ORDER BY id
+"""
+
+
+def create_app(work_dir=None, sql_files=None):
+    """
+    Create an app whose database and sql folder live in work_dir
+    :param sql_files: {relative path: yml content}, defaults to bench/user.yml
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix='flask_sql_pro_bench_')
+    sql_path = os.path.join(work_dir, 'sql')
+    for name, content in (sql_files or {'bench/user.yml': USER_SQL}).items():
+        path = os.path.join(sql_path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(work_dir, 'bench.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['DB_HELPER_SQL_FILE_PATH'] = sql_path
+    db = FlaskSQLPro().init_app(app)
+    app.app_context().push()
+    db.session.execute(
+        'CREATE TABLE IF NOT EXISTS user ('
+        'id INTEGER PRIMARY KEY, name VARCHAR(64), age INTEGER, score REAL, delete_flag INTEGER DEFAULT 0)'
+    )
+    db.session.commit()
+    return app, db
+
+
+def bench(func, number=1000, repeat=5):
+    """
+    Best time of func over repeat runs, in microseconds per call
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / number * 1e6
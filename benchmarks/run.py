@@ -0,0 +1,244 @@
+"""
+Benchmark suite of the loader and helper hot paths on a local SQLite file
+
+    python benchmarks/run.py                                   # print the results
+    python benchmarks/run.py --output baseline.json            # store them
+    python benchmarks/run.py --baseline baseline.json          # compare with a stored run
+    python benchmarks/run.py --large-rows 1000000 --only select
+
+Every case reports the best time of --repeat runs in microseconds per call.
+With --baseline, cases slower than --threshold times the baseline are reported as regressions
+and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+
+import sqlalchemy
+
+from common import USER_SQL, bench, create_app
+
+from flask_sql_pro import DataBaseHelper
+from flask_sql_pro.sql_loader import GlobalData, Loader, SqlLoader
+
+SELECT_SQL = """
+select_limit: |
+    SELECT id, name, age, score FROM user ORDER BY id LIMIT :limit
+select_page: |
+    SELECT id, name, age, score FROM user
+    WHERE 1=1
+    {% if min_age %}
+    AND age >= :min_age
+    {% endif %}
+    ORDER BY id
+"""
+
+CATALOG_QUERY = """
+query_%(n)d: |
+    SELECT id, name, age FROM user
+    WHERE 1=1
+    {%% if min_age %%}
+    AND age >= :min_age
+    {%% endif %%}
+    ORDER BY id
+"""
+
+WHERE = {'id': 1, 'age__gte': 18, 'name__like': 'a%', 'id__in': [1, 2, 3]}
+EXCLUDE = {'score__isnull': True}
+DATA = {'name': 'a', 'age': 20, 'score': 1.5}
+
+
+def generate_catalog(files, queries):
+    """
+    {relative path: yml content} of files catalog files holding queries sql each
+    """
+    content = ''.join(CATALOG_QUERY % {'n': n} for n in range(queries))
+    return {'catalog/file_%d.yml' % n: content for n in range(files)}
+
+
+def fill_user(rows, chunk_size=10000):
+    DataBaseHelper.db.session.execute('DELETE FROM user')
+    for start in range(0, rows, chunk_size):
+        DataBaseHelper.execute_create_many('user', [
+            {'id': i, 'name': 'user_%d' % i, 'age': i % 90, 'score': i * 0.5}
+            for i in range(start, min(start + chunk_size, rows))
+        ], chunk_size=chunk_size)
+    DataBaseHelper.commit()
+
+
+def number_for(rows, budget=200000):
+    """
+    Calls per run so that every run fetches about budget rows
+    """
+    return max(1, min(1000, budget // max(rows, 1)))
+
+
+def catalog_cases(args, work_dir):
+    def load():
+        GlobalData.sql_group = {}
+        GlobalData.sql_files = {}
+        SqlLoader.preload_all_sqls(workers=1, cache_file='')
+
+    cache_file = os.path.join(work_dir, 'catalog.cache')
+
+    def load_cached():
+        GlobalData.sql_group = {}
+        GlobalData.sql_files = {}
+        SqlLoader.preload_all_sqls(workers=1, cache_file=cache_file)
+
+    load_cached()  # Write the cache file
+    yield 'catalog load (%d files x %d sql)' % (args.catalog_files, args.catalog_queries), load, 1
+    yield 'catalog load from cache file', load_cached, 1
+    yield 'catalog reload_changed, nothing changed', Loader.loader.reload_changed, 10
+
+
+def render_cases(args, work_dir):
+    loader = Loader.loader
+    options = {'min_age': 18}
+    paginated = {'min_age': 18, 'page': 3, 'page_size': 20}
+    loader.template_cache.resize(0)
+    yield 'render, template compiled every call', lambda: loader.preload_sql('bench.select.select_page', options), 1000
+    loader.template_cache.resize(512)
+    yield 'render', lambda: loader.preload_sql('bench.select.select_page', options), 10000
+    yield 'render with pagination', lambda: loader.preload_sql('bench.select.select_page', paginated), 10000
+    yield 'get_clause, cached text()', lambda: DataBaseHelper.get_clause('bench.select.select_page', paginated), 10000
+
+
+def select_cases(args, work_dir):
+    fill_user(max(args.rows, args.large_rows))
+    for rows in (1, args.rows, args.large_rows):
+        params = {'limit': rows}
+        number = number_for(rows)
+        for return_obj in (True, False, 'row'):
+            yield (
+                'select %d rows, return_obj=%r' % (rows, return_obj),
+                lambda: DataBaseHelper.select_all('bench.select.select_limit', params, return_obj=return_obj),
+                number,
+            )
+        yield (
+            'select_columns %d rows' % rows,
+            lambda: DataBaseHelper.select_columns('bench.select.select_limit', params),
+            number,
+        )
+        yield (
+            'select_iter %d rows' % rows,
+            lambda: sum(1 for _ in DataBaseHelper.select_iter('bench.select.select_limit', params, return_obj='row')),
+            number,
+        )
+
+
+def insert_cases(args, work_dir):
+    rows = [{'name': 'user_%d' % i, 'age': i % 90, 'score': i * 0.5} for i in range(args.rows)]
+
+    def single():
+        for row in rows:
+            DataBaseHelper.execute_create('user', row)
+        DataBaseHelper.rollback()
+
+    def batched():
+        DataBaseHelper.execute_create_many('user', rows)
+        DataBaseHelper.rollback()
+
+    number = number_for(args.rows, 20000)
+    yield 'insert %d rows one by one' % args.rows, single, number
+    yield 'insert %d rows with execute_create_many' % args.rows, batched, number
+
+
+def build_cases(args, work_dir):
+    yield 'fullfilled_data', lambda: DataBaseHelper.fullfilled_data(dict(DATA), WHERE, exclude=EXCLUDE), 10000
+    yield 'prepare_update', lambda: DataBaseHelper.prepare_update('user', dict(DATA), WHERE, exclude=EXCLUDE), 10000
+    yield 'prepare_delete', lambda: DataBaseHelper.prepare_delete('user', WHERE, exclude=EXCLUDE), 10000
+    yield 'prepare_delete, logic', lambda: DataBaseHelper.prepare_delete('user', WHERE, logic=True), 10000
+    yield 'prepare_create', lambda: DataBaseHelper.prepare_create('user', DATA), 10000
+
+
+GROUPS = {
+    'catalog': catalog_cases,
+    'render': render_cases,
+    'select': select_cases,
+    'insert': insert_cases,
+    'build': build_cases,
+}
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix='flask_sql_pro_bench_')
+    sql_files = generate_catalog(args.catalog_files, args.catalog_queries)
+    sql_files.update({'bench/user.yml': USER_SQL, 'bench/select.yml': SELECT_SQL})
+    create_app(work_dir, sql_files)
+
+    results = {}
+    for group, cases in GROUPS.items():
+        if args.only and group not in args.only:
+            continue
+        for name, func, number in cases(args, work_dir):
+            key = '%s: %s' % (group, name)
+            results[key] = {'us_per_call': bench(func, number, args.repeat), 'number': number}
+            print('%-60s %14.2f us' % (key, results[key]['us_per_call']), file=sys.stderr)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'platform': platform.platform(),
+            'rows': args.rows,
+            'large_rows': args.large_rows,
+            'catalog_files': args.catalog_files,
+            'catalog_queries': args.catalog_queries,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """
+    Print current/baseline ratios
+    :return: names of the cases slower than threshold times the baseline
+    """
+    regressions = []
+    print('%-60s %12s %12s %8s' % ('case', 'baseline us', 'current us', 'ratio'))
+    for name, result in report['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            print('%-60s %12s %12.2f %8s' % (name, '-', result['us_per_call'], 'new'))
+            continue
+        ratio = result['us_per_call'] / previous['us_per_call'] if previous['us_per_call'] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-60s %12.2f %12.2f %7.2fx%s' % (name, previous['us_per_call'], result['us_per_call'], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000, help='rows of the medium select and of the insert cases')
+    parser.add_argument('--large-rows', type=int, default=100000, help='rows of the large select, e.g. 1000000')
+    parser.add_argument('--catalog-files', type=int, default=200, help='generated sql files')
+    parser.add_argument('--catalog-queries', type=int, default=20, help='sql per generated file')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the best one is reported')
+    parser.add_argument('--only', nargs='*', choices=sorted(GROUPS), help='run only these groups')
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--baseline', help='json file written by a previous --output run')
+    parser.add_argument('--threshold', type=float, default=1.2, help='ratio to the baseline reported as a regression')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        return 1 if compare(report, baseline, args.threshold) else 0
+    if not args.output:
+        json.dump(report, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
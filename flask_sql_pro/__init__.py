@@ -1,24 +1,54 @@
 import os
 from contextlib import contextmanager
 
-from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy
-from flask_sql_pro.db import DataBaseHelper
+from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy, SignallingSession as _SignallingSession
+from sqlalchemy import orm
+from flask_sql_pro.cache import LRUCache, ResultCache, SingleFlight
+from flask_sql_pro.db import DataBaseHelper, DBData, DBRow, FanoutError
+from flask_sql_pro.metrics import Metrics
 from flask_sql_pro.sql_loader import SqlLoader, Loader
 
 
+class SignallingSession(_SignallingSession):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """
+        SQLAlchemy >= 1.4 passes the bind of session.execute(..., bind=engine) here, it is used as is
+        """
+        if bind is not None:
+            return bind
+        return super(SignallingSession, self).get_bind(mapper, clause)
+
+
 class SQLAlchemy(_SQLAlchemy):
     """
     Transaction Context Manager
     """
 
+    def create_session(self, options):
+        return orm.sessionmaker(class_=SignallingSession, db=self, **options)
+
     @contextmanager
-    def trans(self):
+    def trans(self, buffered=False, buffer_size=1000):
+        """
+        :param buffered: queue DataBaseHelper.execute_create(..., buffered=True) rows and insert them in batches,
+                         before commit, every buffer_size rows and before any other read or write.
+                         A nested buffered trans shares the buffer of the outer one
+        """
+        if buffered:
+            DataBaseHelper.begin_buffer(buffer_size)
+        # Reads inside the transaction go to the primary
+        info = self.session.info
+        info[DataBaseHelper.trans_depth_key] = info.get(DataBaseHelper.trans_depth_key, 0) + 1
         try:
             yield
             self.session.commit()
         except Exception as e:
             self.session.rollback()
             raise e
+        finally:
+            info[DataBaseHelper.trans_depth_key] -= 1
+            if buffered:
+                DataBaseHelper.end_buffer()
 
 
 class FlaskSQLPro(object):
@@ -36,17 +66,64 @@ class FlaskSQLPro(object):
         DataBaseHelper.page_param = app.config.get('DB_HELPER_PAGE_PARAM', 'page')
         DataBaseHelper.page_size_param = app.config.get('DB_HELPER_PAGE_SIZE_PARAM', 'page_size')
         DataBaseHelper.print_msg = app.config.get('DB_HELPER_PRINT_MSG', False)
+        DataBaseHelper.validate_columns = app.config.get('DB_HELPER_VALIDATE_COLUMNS', False)
+        DataBaseHelper.engine_cache = {}
+        DataBaseHelper.read_replicas = list(app.config.get('DB_HELPER_READ_REPLICAS', []))
+        DataBaseHelper.replica_strategy = app.config.get('DB_HELPER_REPLICA_STRATEGY', 'round_robin')
+        DataBaseHelper.replica_retry_after = app.config.get('DB_HELPER_REPLICA_RETRY_AFTER', 30)
+        DataBaseHelper.replica_down_until = {}
+        if DataBaseHelper.replica_strategy not in ('round_robin', 'least_loaded'):
+            raise ValueError('Unsupported DB_HELPER_REPLICA_STRATEGY: %s' % DataBaseHelper.replica_strategy)
+        DataBaseHelper.in_chunk_sizes = dict(DataBaseHelper.in_chunk_sizes, **app.config.get('DB_HELPER_IN_CHUNK_SIZES', {}))
+        DataBaseHelper.fanout_workers = app.config.get('DB_HELPER_FANOUT_WORKERS', 8)
         SqlLoader.page_param = app.config.get('DB_HELPER_PAGE_PARAM', 'page')
         SqlLoader.page_size_param = app.config.get('DB_HELPER_PAGE_SIZE_PARAM', 'page_size')
+        SqlLoader.keyset_param = app.config.get('DB_HELPER_KEYSET_PARAM', 'keyset')
+        SqlLoader.keyset_cursor_param = app.config.get('DB_HELPER_CURSOR_PARAM', 'cursor')
+        SqlLoader.keyset_order_param = app.config.get('DB_HELPER_ORDER_PARAM', 'order')
+        SqlLoader.template_cache.resize(app.config.get('DB_HELPER_TEMPLATE_CACHE_SIZE', 512))
 
         default_sql_file_path = os.path.join(
             app.instance_path,  # {project_path}/instance/   :path_to flask instance_path
             'sql',
         )
         SqlLoader.SQL_FILE_PATH = app.config.get('DB_HELPER_SQL_FILE_PATH', default_sql_file_path)
+        SqlLoader.preload_workers = app.config.get('DB_HELPER_SQL_PRELOAD_WORKERS', 1)
+        SqlLoader.preload_executor = app.config.get('DB_HELPER_SQL_PRELOAD_EXECUTOR', 'process')
+        SqlLoader.catalog_cache_file = app.config.get('DB_HELPER_SQL_CACHE_FILE')
+
+        DataBaseHelper.clause_cache.resize(app.config.get('DB_HELPER_CLAUSE_CACHE_SIZE', 1024))
+        DataBaseHelper.statement_cache.resize(app.config.get('DB_HELPER_STATEMENT_CACHE_SIZE', 1024))
+        DataBaseHelper.count_cache.resize(app.config.get('DB_HELPER_COUNT_CACHE_SIZE', 1024))
+        DataBaseHelper.count_cache.ttl = app.config.get('DB_HELPER_COUNT_CACHE_TTL', 60)
+        DataBaseHelper.result_cache_enabled = app.config.get('DB_HELPER_RESULT_CACHE', False)
+        DataBaseHelper.result_cache = ResultCache(
+            backend=app.config.get('DB_HELPER_RESULT_CACHE_BACKEND') or LRUCache(app.config.get('DB_HELPER_RESULT_CACHE_SIZE', 1024)),
+            ttl=app.config.get('DB_HELPER_RESULT_CACHE_TTL', 300),
+        )
+        DataBaseHelper.metrics = Metrics(
+            enabled=app.config.get('DB_HELPER_METRICS', False),
+            slow_query_threshold=app.config.get('DB_HELPER_SLOW_QUERY_THRESHOLD'),
+            hooks=app.config.get('DB_HELPER_METRICS_HOOKS'),
+        )
+        DataBaseHelper.single_flight_enabled = app.config.get('DB_HELPER_SINGLE_FLIGHT', False)
+        DataBaseHelper.single_flight = SingleFlight(timeout=app.config.get('DB_HELPER_SINGLE_FLIGHT_TIMEOUT', 10))
+        DataBaseHelper.listen_session_events()
 
         Loader.loader = SqlLoader()
+        SqlLoader.on_reload(DataBaseHelper.invalidate_sqls)
+        if app.config.get('DB_HELPER_SQL_PRELOAD', False):
+            SqlLoader.preload_all_sqls()
+        if app.config.get('DB_HELPER_SQL_AUTO_RELOAD'):
+            Loader.loader.start_watcher(app.config['DB_HELPER_SQL_AUTO_RELOAD'])
+        if app.config.get('DB_HELPER_ASYNC_DATABASE_URI'):
+            # Requires SQLAlchemy >= 1.4 and an async driver
+            from flask_sql_pro.async_db import AsyncDataBaseHelper
+            AsyncDataBaseHelper.init_engine(
+                app.config['DB_HELPER_ASYNC_DATABASE_URI'],
+                binds=app.config.get('DB_HELPER_ASYNC_BINDS'),
+            )
         return _db
 
 
-__all__ = [FlaskSQLPro, DataBaseHelper, SqlLoader]
+__all__ = [FlaskSQLPro, DataBaseHelper, DBData, DBRow, FanoutError, SqlLoader]
@@ -0,0 +1,314 @@
+import asyncio
+import typing
+import weakref
+from contextlib import asynccontextmanager
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_scoped_session, create_async_engine
+
+from flask_sql_pro.db import DataBaseHelper, DBData
+
+
+class AsyncDataBaseHelper(object):
+    """
+    asyncio version of DataBaseHelper built on SQLAlchemy's async engine (SQLAlchemy >= 1.4).
+    Only the methods below are available, the batch, streaming and fan-out helpers of DataBaseHelper have no async version.
+    The sql catalog, the clause/statement caches, the metrics and the result cache invalidation are those of DataBaseHelper,
+    every asyncio task gets its own session.
+    """
+    helper = DataBaseHelper
+    url = None
+    bind_urls = {}
+    engine_options = {}
+    # {event loop: {bind name or None: engine}}, pooled connections can only be used by the loop that opened them
+    loop_engines = weakref.WeakKeyDictionary()
+    session = None
+
+    @classmethod
+    def init_engine(cls, url, binds=None, **engine_options):
+        """
+        Engines are created lazily, one per event loop and bind
+        :param url: async database url, e.g. mysql+aiomysql://... or sqlite+aiosqlite:///...
+        :param binds: {bind name: async database url}, selected with bind= like SQLALCHEMY_BINDS
+        :param engine_options: create_async_engine options
+        """
+        cls.url = url
+        cls.bind_urls = dict(binds or {})
+        cls.engine_options = engine_options
+        cls.loop_engines = weakref.WeakKeyDictionary()
+        cls.session = async_scoped_session(cls.create_session, scopefunc=asyncio.current_task)
+
+    @classmethod
+    def get_engine(cls, bind=None):
+        """
+        Engine of bind for the running event loop
+        """
+        engines = cls.loop_engines.setdefault(asyncio.get_running_loop(), {})
+        engine = engines.get(bind)
+        if engine is None:
+            url = cls.url if bind is None else cls.bind_urls[bind]
+            engine = engines[bind] = create_async_engine(url, **cls.engine_options)
+        return engine
+
+    @classmethod
+    def create_session(cls):
+        return AsyncSession(cls.get_engine(), expire_on_commit=False)
+
+    @classmethod
+    def invalidate_table(cls, tb_name):
+        if cls.helper.result_cache_enabled:
+            cls.helper.result_cache.invalidate(cls.helper.normalize_table(tb_name))
+
+    @classmethod
+    async def execute(cls, sql, params=None, bind=None):
+        bind_arguments = {'bind': cls.get_engine(bind).sync_engine} if bind else None
+        return await cls.session.execute(sql, params, bind_arguments=bind_arguments)
+
+    @classmethod
+    async def execute_sql(cls, sql_id, params=None, options: typing.Dict[str, str] = None, bind=None, return_obj=True):
+        """
+        General methods of dynamic sql
+        :param return_obj: Returns Dict or DBData, 'row' returns compact DBRow
+        :param bind: key of the binds passed to init_engine
+        """
+        helper = cls.helper
+        timer = helper.metrics.timer('sql', sql_id)
+        preloaded_sql = helper.get_clause(sql_id, options=options)
+        try:
+            if timer:
+                timer.lap('render')
+            helper.print('execute <%s>, params: %s', sql_id, params)
+            result = await cls.execute(preloaded_sql, params, bind=bind)
+            if timer:
+                timer.lap('execute')
+            convert = helper.row_converter(result.keys(), return_obj)
+            rows = result.fetchall()
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=params)
+            helper.print("Failed to execute sql: %s %s! Cause :%s", preloaded_sql, params, e)
+            return []
+        converted = [convert(item) for item in rows]
+        if timer:
+            timer.lap('fetch')
+            timer.done(rows=len(converted), params=params)
+        return converted
+
+    @classmethod
+    async def select_all(cls, sql_id, params=None, options: typing.Dict[str, typing.Union[str, int, None]] = None, bind=None, return_obj=True):
+        return await cls.execute_sql(sql_id, params, options, bind=bind, return_obj=return_obj)
+
+    @classmethod
+    async def execute_first(cls, sql_id, params=None, options: typing.Dict[str, str] = None, bind=None, limit=False):
+        helper = cls.helper
+        options = helper.get_params_without_paginated(options)  # No paging required
+        timer = helper.metrics.timer('sql', sql_id)
+        preloaded_sql = helper.get_clause(sql_id, options=options, limit_one=limit)
+        try:
+            if timer:
+                timer.lap('render')
+            result = await cls.execute(preloaded_sql, params, bind=bind)
+            if timer:
+                timer.lap('execute')
+            keys, row = result.keys(), result.first()
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=params)
+            helper.print("Failed to execute sql: %s %s! Cause :%s", preloaded_sql, params, e)
+            return None, None
+        if timer:
+            timer.lap('fetch')
+            timer.done(rows=0 if row is None else 1, params=params)
+        return keys, row
+
+    @classmethod
+    async def select_one(cls, sql_id, params=None, options: typing.Dict[str, str] = None, bind=None, return_obj=True, limit=False):
+        keys, row = await cls.execute_first(sql_id, params, options, bind=bind, limit=limit)
+        if row is None:
+            return DBData()
+        if return_obj == 'row':
+            return cls.helper.row_converter(keys, return_obj)(row)
+        return DBData(zip(keys, row))
+
+    @classmethod
+    async def select_scalar(cls, sql_id, params=None, options: typing.Dict[str, str] = None, bind=None, default=None, limit=False):
+        _, row = await cls.execute_first(sql_id, params, options, bind=bind, limit=limit)
+        return default if row is None else row[0]
+
+    @classmethod
+    async def select_count(cls, sql_id, params=None, options: typing.Dict[str, typing.Union[str, int, None]] = None, bind=None, use_cache=True):
+        """
+        Count the rows of dynamic sql with SELECT COUNT(*) FROM (sql), paging options are ignored
+        :param use_cache: reuse the total counted within DB_HELPER_COUNT_CACHE_TTL seconds for the same params and options
+        :return: total, None when the execution fails
+        """
+        helper = cls.helper
+        options = helper.get_params_without_paginated(options)
+        key = helper.count_cache_key(sql_id, params, options, bind) if use_cache else None
+        if key is not None:
+            total = helper.count_cache.get(key)
+            if total is not None:
+                return total
+
+        timer = helper.metrics.timer('sql', sql_id + ':count')
+        preloaded_sql = helper.get_clause(sql_id, options=options, count=True)
+        try:
+            if timer:
+                timer.lap('render')
+            result = await cls.execute(preloaded_sql, params, bind=bind)
+            total = result.scalar()
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=params)
+            helper.print("Failed to execute sql: %s %s! Cause :%s", preloaded_sql, params, e)
+            return None
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=1, params=params)
+        if key is not None:
+            helper.count_cache.set(key, total)
+        return total
+
+    @classmethod
+    async def select_page(cls, sql_id, params=None, options: typing.Dict[str, typing.Union[str, int, None]] = None, bind=None, return_obj=True, use_cache=True):
+        """
+        Query one page together with the total number of rows
+        :param options: dynamic sql conditions, page/page_size default to 1/10
+        :return: DBData(rows=..., total=..., page=..., page_size=...)
+        """
+        options, page, page_size = cls.helper.page_options(options)
+        rows = await cls.execute_sql(sql_id, params, options, bind=bind, return_obj=return_obj)
+        total = await cls.select_count(sql_id, params, options, bind=bind, use_cache=use_cache)
+        return DBData(rows=rows, total=total, page=page, page_size=page_size)
+
+    @classmethod
+    async def select_keyset(cls, sql_id, params=None, options: typing.Dict[str, typing.Union[str, int, None]] = None, cursor=None, last_value=None, bind=None, return_obj=True):
+        """
+        Keyset paging like DataBaseHelper.select_keyset
+        :return: (rows, next_cursor), next_cursor is None on the last page
+        """
+        params, options = cls.helper.keyset_options(params, options, cursor, last_value)
+        rows = await cls.execute_sql(sql_id, params, options, bind=bind, return_obj=return_obj)
+        return rows, cls.helper.next_cursor(rows, options)
+
+    @classmethod
+    async def execute_create(cls, tb_name, data, bind=None, commit=False):
+        """
+        Insert data
+        :return: indicates the id of the inserted data
+        """
+        helper = cls.helper
+        timer = helper.metrics.timer('table', tb_name)
+        tb_name = helper.validate_identifier(tb_name)
+        cls.invalidate_table(tb_name)
+        sql = helper.build_create(tb_name, data)
+        try:
+            if timer:
+                timer.lap('render')
+            result = await cls.execute(sql, data, bind=bind)
+            if commit:
+                await cls.session.commit()
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=data)
+            helper.print("Failed to execute sql: < %s %s >! Cause: %s", sql, data, e)
+            return None
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=1, params=data)
+        return result.lastrowid
+
+    @classmethod
+    async def execute_update(cls, tb_name, data, where, bind=None, commit=False, exclude=None):
+        """
+        Update data, where/exclude are bound as _where_${field}/_exclude_${field} like DataBaseHelper.execute_update
+        :return: update quantity
+        """
+        helper = cls.helper
+        timer = helper.metrics.timer('table', tb_name)
+        tb_name = helper.validate_identifier(tb_name)
+        cls.invalidate_table(tb_name)
+        sql, data = helper.build_update(tb_name, data, where, exclude=exclude)
+        try:
+            if timer:
+                timer.lap('render')
+            result = await cls.execute(sql, data, bind=bind)
+            if commit:
+                await cls.session.commit()
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=data)
+            helper.print("Failed to execute sql: < %s %s >! Cause: %s", sql, data, e)
+            return None
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=result.rowcount, params=data)
+        return result.rowcount
+
+    @classmethod
+    async def execute_delete(cls, tb_name, where, logic=False, bind=None, commit=False, exclude=None):
+        """
+        Delete data
+        :return: indicates the number of deleted items
+        """
+        helper = cls.helper
+        timer = helper.metrics.timer('table', tb_name)
+        tb_name = helper.validate_identifier(tb_name)
+        cls.invalidate_table(tb_name)
+        sql, where = helper.build_delete(tb_name, where, logic=logic, exclude=exclude)
+        try:
+            if timer:
+                timer.lap('render')
+            result = await cls.execute(sql, where, bind=bind)
+            if commit:
+                await cls.session.commit()
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=where)
+            helper.print("Failed to execute sql: < %s %s >! Cause: %s", sql, where, e)
+            return None
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=result.rowcount, params=where)
+        return result.rowcount
+
+    @classmethod
+    @asynccontextmanager
+    async def trans(cls):
+        """
+        Transaction Context Manager
+        """
+        try:
+            yield
+            await cls.session.commit()
+        except Exception as e:
+            await cls.session.rollback()
+            raise e
+
+    @classmethod
+    async def flush(cls):
+        await cls.session.flush()
+
+    @classmethod
+    async def commit(cls):
+        await cls.session.commit()
+
+    @classmethod
+    async def rollback(cls):
+        await cls.session.rollback()
+
+    @classmethod
+    async def close(cls):
+        """
+        Close and discard the session of the current task, call it when the request is done
+        """
+        await cls.session.remove()
+
+    @classmethod
+    async def dispose(cls):
+        """
+        Close the pooled connections of the running event loop, call it before the loop shuts down,
+        e.g. at the end of every asyncio.run
+        """
+        engines = cls.loop_engines.pop(asyncio.get_running_loop(), {})
+        for engine in engines.values():
+            await engine.dispose()
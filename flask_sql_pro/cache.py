@@ -0,0 +1,230 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread-safe LRU cache with a bounded capacity and hit/miss counters.
+    Entries expire ttl seconds after they are set when ttl is given.
+    """
+
+    def __init__(self, capacity=256, ttl=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if not self.capacity:
+            return value
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        """
+        Delete every entry whose key matches the predicate
+        """
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def resize(self, capacity):
+        with self._lock:
+            self.capacity = capacity
+            while len(self._data) > max(capacity, 0):
+                self._data.popitem(last=False)
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+class ResultCache(object):
+    """
+    Query result cache, every entry is tagged with the versions of the tables it depends on.
+    Writing a table replaces its version, so entries built on the previous version are never hit again
+    and age out of the backend.
+    The versions are stored in the backend next to the entries, so processes sharing a backend
+    (e.g. memcached or redis) see each other's writes. A version is a token unique to the process
+    that wrote it rather than a counter, concurrent writes of two processes never end up on the same version.
+    The backend is any object with get(key, default=None), set(key, value, ttl=None) and clear(), LRUCache by default,
+    versions are set with ttl=0 and must not expire.
+    """
+    version_key = '__version__'
+
+    def __init__(self, backend=None, ttl=300):
+        self.backend = backend if backend is not None else LRUCache(1024)
+        self.ttl = ttl
+        self._counter = itertools.count(1)
+
+    def new_version(self):
+        return '%d:%d:%d' % (os.getpid(), time.time_ns(), next(self._counter))
+
+    def get_version(self, table):
+        version = self.backend.get((self.version_key, table))
+        if version is None:
+            # Never written or evicted: start a new version, entries tagged before can't be trusted
+            version = self.new_version()
+            self.backend.set((self.version_key, table), version, 0)
+        return version
+
+    def tag(self, key, tables):
+        """
+        Take the key together with the current versions of its tables, before the query is executed
+        """
+        return key, tuple(self.get_version(table) for table in tables)
+
+    def get(self, tagged_key):
+        return self.backend.get(tagged_key)
+
+    def set(self, tagged_key, value, ttl=None):
+        return self.backend.set(tagged_key, value, ttl or self.ttl)
+
+    def invalidate(self, table):
+        self.backend.set((self.version_key, table), self.new_version(), 0)
+
+    def delete_sqls(self, sql_ids):
+        """
+        Drop the entries of sql_ids, the whole backend when it can't delete by key
+        """
+        if hasattr(self.backend, 'delete_where'):
+            self.backend.delete_where(lambda tagged_key: tagged_key[0] != self.version_key and tagged_key[0][0] in sql_ids)
+        else:
+            self.backend.clear()
+
+    def clear(self):
+        self.backend.clear()
+
+
+class SingleFlight(object):
+    """
+    Collapse concurrent calls with the same key into one execution, the other callers wait for its result.
+    A caller waiting longer than timeout seconds, or whose leader raised, runs the call itself.
+    """
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self.executions = 0
+        self.collapsed = 0
+        self.timeouts = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        :return: (result, shared), shared is True when the result comes from another caller's execution
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            if call.event.wait(self.timeout):
+                if call.ok:
+                    with self._lock:
+                        self.collapsed += 1
+                    return call.result, True
+            else:
+                with self._lock:
+                    self.timeouts += 1
+            return func(), False
+
+        try:
+            call.result = func()
+            call.ok = True
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+    def stats(self):
+        return {
+            'executions': self.executions,
+            'collapsed': self.collapsed,
+            'timeouts': self.timeouts,
+            'in_flight': len(self._calls),
+        }
+
+
+class _Call(object):
+    __slots__ = ('event', 'result', 'ok')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.ok = False
+
+
+def make_key(value):
+    """
+    Turn options/params into a hashable cache key, None when the value can't be hashed
+    """
+    if not value:
+        return ()
+    try:
+        return _freeze(value)
+    except TypeError:
+        return None
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    hash(value)
+    # 1, 1.0 and True hash equal but may render different sql
+    return type(value).__name__, value
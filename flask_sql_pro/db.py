@@ -1,10 +1,23 @@
+import base64
 import copy
+import csv
+import heapq
+import io
+import json
+import itertools
 import re
+import threading
+import time
 import typing
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 
+from sqlalchemy import bindparam, event, inspect, text
 from sqlalchemy.sql import compiler
 from sqlalchemy.sql.elements import TextClause
 
+from flask_sql_pro.cache import LRUCache, ResultCache, SingleFlight, make_key
+from flask_sql_pro.metrics import Metrics
 from flask_sql_pro.sql_loader import Loader
 
 
@@ -23,6 +36,82 @@ class DBData(dict):
             self[key] = value
 
 
+class DBRow(object):
+    """
+    Compact read-only row, every row of a result shares one key-to-index map.
+    Get data with point and bracket like DBData, to_dict() builds a DBData only when asked.
+    """
+    __slots__ = ('_keymap', '_values')
+
+    def __init__(self, keymap, values):
+        self._keymap = keymap
+        self._values = values
+
+    def __getattr__(self, key):
+        if key in DBRow.__slots__:
+            raise AttributeError(key)
+        index = self._keymap.get(key)
+        return None if index is None else self._values[index]
+
+    def __getitem__(self, key):
+        return self._values[self._keymap[key]]
+
+    def __contains__(self, key):
+        return key in self._keymap
+
+    def __iter__(self):
+        return iter(self._keymap)
+
+    def __len__(self):
+        return len(self._keymap)
+
+    def __eq__(self, other):
+        if isinstance(other, DBRow):
+            return self._keymap == other._keymap and self._values == other._values
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return self._keymap, self._values
+
+    def __setstate__(self, state):
+        self._keymap, self._values = state
+
+    def __repr__(self):
+        return 'DBRow(%r)' % (self.to_dict(),)
+
+    def get(self, key, default=None):
+        index = self._keymap.get(key)
+        return default if index is None else self._values[index]
+
+    def keys(self):
+        return self._keymap.keys()
+
+    def values(self):
+        return [self._values[index] for index in self._keymap.values()]
+
+    def items(self):
+        return [(key, self._values[index]) for key, index in self._keymap.items()]
+
+    def to_dict(self):
+        return DBData(self.items())
+
+
+class FanoutError(Exception):
+    """
+    Raised by DataBaseHelper.select_all_across when some binds failed
+    errors: {bind: exception} of the failed binds, results: {bind: rows} of the binds that succeeded
+    """
+
+    def __init__(self, sql_id, errors, results):
+        super(FanoutError, self).__init__('Failed to execute %s on %s' % (sql_id, ', '.join(map(str, errors))))
+        self.errors = errors
+        self.results = results
+
+
 class DataBaseHelper(object):
     db = None
     page_param = None
@@ -30,10 +119,61 @@ class DataBaseHelper(object):
     logic_delete_flag = None
     print_msg = False
     sql_injection_keywords = ['DROP', 'SELECT', 'DELETE' 'UPDATE', 'INSERT', 'EXEC', '--', '/*', '*/', 'xp_', 'sp_']
+    keyword_pattern = None
+    # Plain names, or names quoted in backticks, which may also contain # (a comment outside quotes on MySQL)
+    identifier_pattern = re.compile(r'^(`[^\W\d][\w$#]*`|[^\W\d][\w$]*)(\.(`[^\W\d][\w$#]*`|[^\W\d][\w$]*))?$')
+    operator_pattern = re.compile(r'__(gt|gte|lt|lte|like|in|isnull|between)$')
+    validate_columns = False
+    column_cache = {}
+    # Rendered text() constructs keyed by (sql_id, options), cleared when the SqlLoader reloads
+    clause_cache = LRUCache(1024)
+    # Totals of select_page keyed by (sql_id, params, options, bind)
+    count_cache = LRUCache(1024, ttl=60)
+    # Write statements keyed by (operation, tb_name, data keys, where/exclude shape, ...)
+    statement_cache = LRUCache(1024)
+    # Opt-in cache of select results, only sql_ids declaring the tables they read are cached
+    result_cache_enabled = False
+    result_cache = ResultCache()
+    cached_sqls = {}
+    dirty_tables_key = 'flask_sql_pro_dirty_tables'
+    # execute_create rows queued inside db.trans(buffered=True)
+    insert_buffer_key = 'flask_sql_pro_insert_buffer'
+    # Opt-in collapsing of identical concurrent execute_sql calls
+    single_flight_enabled = False
+    single_flight = SingleFlight()
+    # Binds of SQLALCHEMY_BINDS receiving the reads that don't name a bind, see choose_replica
+    read_replicas = []
+    replica_strategy = 'round_robin'
+    replica_retry_after = 30
+    replica_counter = itertools.count()
+    replica_load = {}
+    replica_down_until = {}
+    replica_lock = threading.Lock()
+    # Set in session.info once the session writes, or while db.trans() is open:
+    # reads stay on the primary and don't share results with other sessions
+    pin_primary_key = 'flask_sql_pro_pin_primary'
+    trans_depth_key = 'flask_sql_pro_trans_depth'
+    # Timings, row and error counts per sql_id and table, disabled unless DB_HELPER_METRICS is set
+    metrics = Metrics()
+    # Longest where __in list bound in one statement by dialect name, longer lists are split into several statements
+    in_chunk_sizes = {'sqlite': 900, 'mssql': 2000, 'oracle': 1000, 'default': 5000}
+    # Bind params allowed in one statement by dialect name, SQLite >= 3.32 allows 32766
+    param_limits = {'sqlite': 999, 'postgresql': 65535, 'mysql': 65535, 'mssql': 2100, 'default': 999}
+    # Engines of SQLALCHEMY_BINDS keyed by bind name, cleared by FlaskSQLPro.init_app
+    engine_cache = {}
+    # Thread pool running select_all_across, created on first use
+    fanout_workers = 8
+    fanout_executor = None
+    fanout_lock = threading.Lock()
 
     @classmethod
-    def print(cls, msg):
+    def print(cls, msg, *args):
+        """
+        Print when DB_HELPER_PRINT_MSG is on, msg is only formatted with args then
+        """
         if cls.print_msg:
+            if args:
+                msg = msg % args
             print(f"\033[92m{msg}\033[0m")
 
     @classmethod
@@ -47,13 +187,73 @@ class DataBaseHelper(object):
             del params_cp[cls.page_size_param]
         return params_cp
 
+    @classmethod
+    def get_keyword_pattern(cls):
+        """
+        sql_injection_keywords compiled into one case-insensitive regex, recompiled when the list changes
+        """
+        keywords = tuple(cls.sql_injection_keywords)
+        if cls.keyword_pattern is None or cls.keyword_pattern[0] != keywords:
+            cls.keyword_pattern = (keywords, re.compile('|'.join(re.escape(k) for k in keywords), re.IGNORECASE))
+        return cls.keyword_pattern[1]
+
     @classmethod
     def filter_sql_injection(cls, input_string):
-        for keyword in cls.sql_injection_keywords:
-            if keyword in input_string.upper():
-                raise ValueError('Keywords that may be at risk for SQL injection:' + keyword)
+        matched = cls.get_keyword_pattern().search(input_string)
+        if matched:
+            raise ValueError('Keywords that may be at risk for SQL injection:' + matched.group(0).upper())
         return input_string
 
+    @classmethod
+    def validate_identifier(cls, name):
+        """
+        Table and column names are written into the sql, only plain (optionally quoted or schema-qualified) names are allowed.
+        Values are always sent as bind parameters and need no check.
+        """
+        if not isinstance(name, str) or not cls.identifier_pattern.match(name):
+            raise ValueError('Invalid identifier that may be at risk for SQL injection: ' + str(name))
+        return name
+
+    @classmethod
+    def get_engine(cls, app=None, bind=None):
+        """
+        Engine of a bind, looked up through flask-sqlalchemy once and then reused
+        """
+        engine = cls.engine_cache.get(bind)
+        if engine is None:
+            engine = cls.engine_cache[bind] = cls.db.get_engine(app, bind=bind)
+        return engine
+
+    @classmethod
+    def get_table_columns(cls, tb_name, app=None, bind=None):
+        """
+        Column names of tb_name reflected from the database, cached once per bind
+        """
+        key = (bind if app and bind else None, cls.normalize_table(tb_name))
+        columns = cls.column_cache.get(key)
+        if columns is None:
+            engine = cls.get_engine(app, bind) if app and bind else cls.db.engine
+            # Only the cache key is case-folded, case-sensitive names (e.g. quoted in PostgreSQL) are reflected as written
+            schema, _, table = tb_name.replace('`', '').replace('"', '').strip().rpartition('.')
+            columns = frozenset(c['name'].lower() for c in inspect(engine).get_columns(table, schema=schema or None))
+            if not columns:
+                raise ValueError('Table not found: ' + tb_name)
+            cls.column_cache[key] = columns
+        return columns
+
+    @classmethod
+    def check_columns(cls, tb_name, names, app=None, bind=None):
+        """
+        With DB_HELPER_VALIDATE_COLUMNS, every field and where/exclude key must be a column of tb_name
+        """
+        if not cls.validate_columns:
+            return
+        columns = cls.get_table_columns(tb_name, app=app, bind=bind)
+        for name in names:
+            column = cls.operator_pattern.sub('', name).replace('`', '').lower()
+            if column not in columns:
+                raise ValueError('Unknown column of %s: %s' % (tb_name, name))
+
     @classmethod
     def handle_ops(cls, key, val, opt_type="where"):
         """
@@ -98,7 +298,8 @@ class DataBaseHelper(object):
                     phrase = f"{_key} {sql_op} :{filter_str}{key} AND "
                 return phrase
 
-        return f"{key} = :_where_{key} AND"
+        sql_op = '=' if opt_type == 'where' else '!='
+        return f"{key} {sql_op} :{filter_str}{key} AND "
 
     @classmethod
     def set_where_phrase(cls, sql, where):
@@ -140,9 +341,10 @@ class DataBaseHelper(object):
         """
         Avoid sql injection
         """
-        if any(keyword in str(k).upper() for keyword in cls.sql_injection_keywords):
+        pattern = cls.get_keyword_pattern()
+        if pattern.search(str(k)):
             raise ValueError('Keywords that may be at risk for SQL injection in key: ' + str(k))
-        if any(keyword in str(v).upper() for keyword in cls.sql_injection_keywords):
+        if pattern.search(str(v)):
             raise ValueError('Keywords that may be at risk for SQL injection in value: ' + str(v))
 
     @classmethod
@@ -172,7 +374,7 @@ class DataBaseHelper(object):
             return data
 
         for k, v in where.items():
-            cls.check_sql_injection(k, v)
+            cls.validate_identifier(k)
 
             if k.startswith("_where_"):
                 raise Exception("The where condition cannot contain a field starting with _where_")
@@ -189,7 +391,7 @@ class DataBaseHelper(object):
         # Exclude
         if exclude:
             for k, v in exclude.items():
-                cls.check_sql_injection(k, v)
+                cls.validate_identifier(k)
 
                 if k.startswith("_exclude_"):
                     raise Exception("The exclude condition cannot contain a field starting with _exclude_")
@@ -223,27 +425,329 @@ class DataBaseHelper(object):
         :param commit: indicates whether to submit the transaction
         :return: update quantity
         """
-        tb_name = cls.filter_sql_injection(tb_name)
-        sql = "UPDATE " + tb_name + " SET "
-        for key in data.keys():
-            sql += "`%s`" % key + " = :" + key + ","
-        sql = sql[0:-1]
-
-        data = cls.fullfilled_data(data, where, exclude=exclude)
-        sql = cls.set_where_phrase(sql, where)
-        sql = cls.set_exclude_phrase(sql, exclude)
+        cls.flush_inserts()
+        timer = cls.metrics.timer('table', tb_name)
+        sql, data = cls.prepare_update(tb_name, data, where, exclude=exclude, app=app, bind=bind)
         try:
+            if timer:
+                timer.lap('render')
+            chunks = cls.split_in_params(data, where, app=app, bind=bind)
             if app and bind:
-                bind = cls.db.get_engine(app, bind=bind)
-                result = cls.db.session.execute(sql, data, bind=bind)
-            else:
-                result = cls.db.session.execute(sql, data)
+                bind = cls.get_engine(app, bind)
+            rowcount = 0
+            for params in chunks:
+                if app and bind:
+                    result = cls.db.session.execute(sql, params, bind=bind)
+                else:
+                    result = cls.db.session.execute(sql, params)
+                rowcount += result.rowcount
+            if commit:
+                cls.db.session.commit()
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=data)
+            cls.print("Failed to execute sql: < %s %s >! Cause: %s", sql, data, e)
+            return None
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=rowcount, params=data)
+        return rowcount
+
+    @classmethod
+    def prepare_update(cls, tb_name, data, where, exclude=None, app=None, bind=None):
+        """
+        Statement and bind parameters of execute_update
+        """
+        tb_name = cls.validate_identifier(tb_name)
+        cls.invalidate_table(tb_name)
+        cls.check_columns(tb_name, tuple(data.keys()) + tuple(where or ()) + tuple(exclude or ()), app=app, bind=bind)
+        return cls.build_update(tb_name, data, where, exclude=exclude)
+
+    @classmethod
+    def build_update(cls, tb_name, data, where, exclude=None):
+        """
+        Statement and bind parameters updating the validated tb_name, without invalidation nor column checks
+        """
+        keys = tuple(data.keys())
+        sql = cls.get_statement(
+            ('update', tb_name, keys, cls.condition_shape(where), cls.condition_shape(exclude)),
+            lambda: cls.set_exclude_phrase(cls.set_where_phrase(cls.get_update_sql(tb_name, keys), where), exclude),
+            expanding=cls.in_params(where, exclude),
+        )
+        return sql, cls.fullfilled_data(data, where, exclude=exclude)
+
+    @classmethod
+    def prepare_create(cls, tb_name, data, app=None, bind=None):
+        """
+        Statement of execute_create
+        """
+        tb_name = cls.validate_identifier(tb_name)
+        cls.invalidate_table(tb_name)
+        cls.check_columns(tb_name, tuple(data.keys()), app=app, bind=bind)
+        return cls.build_create(tb_name, data)
+
+    @classmethod
+    def build_create(cls, tb_name, data):
+        """
+        Statement inserting data into the validated tb_name, without invalidation nor column checks
+        """
+        keys = tuple(data.keys())
+        return cls.get_statement(('create', tb_name, keys), lambda: cls.get_insert_sql(tb_name, keys))
+
+    @classmethod
+    def prepare_delete(cls, tb_name, where, logic=False, exclude=None, app=None, bind=None):
+        """
+        Statement and bind parameters of execute_delete
+        """
+        tb_name = cls.validate_identifier(tb_name)
+        cls.invalidate_table(tb_name)
+        cls.check_columns(tb_name, tuple(where or ()) + tuple(exclude or ()), app=app, bind=bind)
+        return cls.build_delete(tb_name, where, logic=logic, exclude=exclude)
+
+    @classmethod
+    def build_delete(cls, tb_name, where, logic=False, exclude=None):
+        """
+        Statement and bind parameters deleting from the validated tb_name, without invalidation nor column checks
+        """
+        if logic and not cls.logic_delete_flag:
+            raise Exception("Logic delete flag is not defined")
+
+        def build():
+            sql = "DELETE FROM " + tb_name
+            if logic:
+                sql = "UPDATE %s SET %s=1" % (tb_name, cls.logic_delete_flag)
+            sql = cls.set_where_phrase(sql, where)
+            return cls.set_exclude_phrase(sql, exclude)
+
+        sql = cls.get_statement(
+            ('delete', tb_name, cls.condition_shape(where), cls.condition_shape(exclude), logic and cls.logic_delete_flag),
+            build,
+            expanding=cls.in_params(where, exclude),
+        )
+        return sql, cls.fullfilled_data({}, where, exclude=exclude)
+
+    @classmethod
+    def get_statement(cls, key, build, expanding=()):
+        """
+        Reuse the text() construct of a write statement, build() generates the sql only on a miss
+        :param key: (operation, tb_name, ...) identifying the shape of the statement
+        :param build: returns the sql
+        :param expanding: bind params holding a list, rendered as IN (:p_1, :p_2, ...) at execution
+        :return: TextClause
+        """
+        statement = cls.statement_cache.get(key)
+        if statement is None:
+            statement = text(build())
+            if expanding:
+                statement = statement.bindparams(*[bindparam(name, expanding=True) for name in expanding])
+            statement = cls.statement_cache.set(key, statement)
+        return statement
+
+    @staticmethod
+    def in_params(where, exclude=None):
+        """
+        Bind params of the __in conditions of where/exclude
+        """
+        return tuple("_where_%s" % key for key in (where or ()) if key.endswith('__in')) + tuple(
+            "_exclude_%s" % key for key in (exclude or ()) if key.endswith('__in')
+        )
+
+    @classmethod
+    def get_in_chunk_size(cls, length, app=None, bind=None):
+        """
+        Chunk size of an __in list of length values, None when the list fits in one statement.
+        The dialect is only looked up for lists longer than the smallest chunk size.
+        """
+        sizes = cls.in_chunk_sizes
+        if length <= min((size for size in sizes.values() if size), default=length):
+            return None
+        size = sizes.get(cls.get_dialect(app=app, bind=bind).name, sizes.get('default'))
+        return size if size and length > size else None
+
+    @classmethod
+    def split_in_params(cls, data, where, app=None, bind=None):
+        """
+        Split the bind params of a statement whose longest where __in list exceeds the chunk size of the dialect
+        The list is deduplicated and cut into chunks, every chunk runs the same statement.
+        Exclude __in lists (NOT IN) can't be split across statements and are always bound whole.
+        :return: list of bind params, one per execution
+        """
+        key = max(
+            (k for k, v in (where or {}).items() if k.endswith('__in') and isinstance(v, (list, tuple))),
+            key=lambda k: len(where[k]), default=None,
+        )
+        if key is None:
+            return [data]
+        chunk_size = cls.get_in_chunk_size(len(where[key]), app=app, bind=bind)
+        if not chunk_size:
+            return [data]
+        name = "_where_%s" % key
+        values = list(dict.fromkeys(where[key]))
+        return [dict(data, **{name: values[start:start + chunk_size]}) for start in range(0, len(values), chunk_size)]
+
+    @staticmethod
+    def condition_shape(conditions):
+        """
+        The part of where/exclude that changes the generated sql: the keys, plus the value of __isnull keys
+        """
+        if not conditions:
+            return ()
+        return tuple((key, bool(val)) if key.endswith('__isnull') else key for key, val in conditions.items())
+
+    @classmethod
+    def get_update_sql(cls, tb_name, keys):
+        """
+        Generate update statement without the where phrase
+        """
+        keys = [cls.validate_identifier(key) for key in keys]
+        return "UPDATE " + tb_name + " SET " + ",".join("`%s` = :%s" % (key, key) for key in keys)
+
+    @classmethod
+    def execute_update_many(cls, tb_name, rows, key='id', chunk_size=1000, app=None, bind=None, commit=False):
+        """
+        Update many rows, each with its own values, matched by key
+        Rows are grouped by their key set, every group builds one UPDATE ... WHERE key = :_where_key
+        and sends chunk_size rows per executemany round trip.
+        :param bind:
+        :param app:
+        :param tb_name: indicates the table name
+        :param rows: list of dicts, each containing key and the fields to update
+        :param key: field used to match the rows, it is not updated
+        :param chunk_size: number of rows per round trip
+        :param commit: indicates whether to submit the transaction
+        :return: update quantity
+        """
+        cls.flush_inserts()
+        timer = cls.metrics.timer('table', tb_name)
+        tb_name = cls.validate_identifier(tb_name)
+        cls.invalidate_table(tb_name)
+        cls.validate_identifier(key)
+        where_key = "_where_%s" % key
+        bind_name = bind
+        if app and bind:
+            bind = cls.get_engine(app, bind)
+
+        rowcount = 0
+        sql = None
+        try:
+            for keys, group in cls.group_rows(rows).items():
+                cls.check_columns(tb_name, keys, app=app, bind=bind_name)
+                fields = [k for k in keys if k != key]
+                if key not in keys:
+                    raise Exception("Every row must contain the key field: %s" % key)
+                if any(k.startswith("_where_") for k in fields):
+                    raise Exception("The data cannot contain a field starting with _where_")
+                sql = cls.get_statement(
+                    ('update_many', tb_name, tuple(fields), key),
+                    lambda: cls.set_where_phrase(cls.get_update_sql(tb_name, fields), {key: None}),
+                )
+                for start in range(0, len(group), chunk_size):
+                    data = [
+                        dict({k: row[k] for k in fields}, **{where_key: row[key]})
+                        for row in group[start:start + chunk_size]
+                    ]
+                    if bind:
+                        result = cls.db.session.execute(sql, data, bind=bind)
+                    else:
+                        result = cls.db.session.execute(sql, data)
+                    rowcount += result.rowcount
             if commit:
                 cls.db.session.commit()
-            return result.rowcount
         except Exception as e:
-            cls.print("Failed to execute sql: < %s %s >! Cause: %s" % (sql, str(data), str(e)))
+            if timer:
+                timer.done(error=e)
+            cls.print("Failed to execute sql: < %s >! Cause: %s", sql, e)
             return None
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=rowcount)
+        return rowcount
+
+    @classmethod
+    def get_upsert_sql(cls, dialect, tb_name, keys, conflict_keys, update_fields):
+        """
+        Generate the dialect-native insert-or-update statement
+        MySQL: ON DUPLICATE KEY UPDATE, SQLite/PostgreSQL: ON CONFLICT (...) DO UPDATE
+        """
+        quote = dialect.identifier_preparer.quote_identifier
+        keys = [cls.validate_identifier(key) for key in keys]
+        sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+            tb_name, ",".join(quote(key) for key in keys), ",".join(":" + key for key in keys)
+        )
+        if dialect.name == 'mysql':
+            if not update_fields:
+                # Keep the existing row untouched: the conflict may come from any unique index,
+                # so assigning the incoming value of a conflict key could rewrite the key of another row
+                return sql + " ON DUPLICATE KEY UPDATE %s = %s" % (quote(conflict_keys[0]), quote(conflict_keys[0]))
+            return sql + " ON DUPLICATE KEY UPDATE " + ",".join(
+                "%s = VALUES(%s)" % (quote(field), quote(field)) for field in update_fields
+            )
+        if dialect.name in ('sqlite', 'postgresql'):
+            sql += " ON CONFLICT (%s) " % ",".join(quote(key) for key in conflict_keys)
+            if not update_fields:
+                return sql + "DO NOTHING"
+            return sql + "DO UPDATE SET " + ",".join(
+                "%s = excluded.%s" % (quote(field), quote(field)) for field in update_fields
+            )
+        raise Exception("Upsert is not supported by dialect: %s" % dialect.name)
+
+    @classmethod
+    def execute_upsert(cls, tb_name, rows, conflict_keys, update_fields=None, chunk_size=1000, app=None, bind=None, commit=False):
+        """
+        Insert rows, updating the existing ones that conflict on conflict_keys
+        Rows are grouped by their key set, every group builds one statement and sends chunk_size rows per round trip.
+        :param bind:
+        :param app:
+        :param tb_name: indicates the table name
+        :param rows: list of dicts
+        :param conflict_keys: fields of the unique index (ignored by MySQL, which uses any unique index)
+        :param update_fields: fields updated on conflict, defaults to every field of the row except conflict_keys
+        :param chunk_size: number of rows per round trip
+        :param commit: indicates whether to submit the transaction
+        :return: affected rows as reported by the driver (MySQL counts an updated row twice)
+        """
+        cls.flush_inserts()
+        timer = cls.metrics.timer('table', tb_name)
+        tb_name = cls.validate_identifier(tb_name)
+        cls.invalidate_table(tb_name)
+        conflict_keys = [conflict_keys] if isinstance(conflict_keys, str) else list(conflict_keys)
+        for key in conflict_keys + list(update_fields or []):
+            cls.validate_identifier(key)
+        dialect = cls.get_dialect(app=app, bind=bind)
+        bind_name = bind
+        if app and bind:
+            bind = cls.get_engine(app, bind)
+
+        rowcount = 0
+        sql = None
+        try:
+            for keys, group in cls.group_rows(rows).items():
+                cls.check_columns(tb_name, keys, app=app, bind=bind_name)
+                fields = update_fields
+                if fields is None:
+                    fields = [k for k in keys if k not in conflict_keys]
+                sql = cls.get_statement(
+                    ('upsert', dialect.name, tb_name, keys, tuple(conflict_keys), tuple(fields)),
+                    lambda: cls.get_upsert_sql(dialect, tb_name, keys, conflict_keys, fields),
+                )
+                for start in range(0, len(group), chunk_size):
+                    chunk = group[start:start + chunk_size]
+                    if bind:
+                        result = cls.db.session.execute(sql, chunk, bind=bind)
+                    else:
+                        result = cls.db.session.execute(sql, chunk)
+                    rowcount += result.rowcount
+            if commit:
+                cls.db.session.commit()
+        except Exception as e:
+            if timer:
+                timer.done(error=e)
+            cls.print("Failed to execute sql: < %s >! Cause: %s", sql, e)
+            return None
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=rowcount)
+        return rowcount
 
     @classmethod
     def allow_sharp(cls):
@@ -252,9 +756,12 @@ class DataBaseHelper(object):
         """
         compiler.BIND_PARAMS = re.compile(r"(?<![:\w$\x5c]):([\w$#]+)(?![:\w$])", re.UNICODE)
         TextClause._bind_params_regex = re.compile(r'(?<![:\w\x5c]):([\w#]+)(?!:)', re.UNICODE)
+        # Cached constructs were parsed with the previous regex
+        cls.statement_cache.clear()
+        cls.clause_cache.clear()
 
     @classmethod
-    def execute_create(cls, tb_name, data, app=None, bind=None, commit=False):
+    def execute_create(cls, tb_name, data, app=None, bind=None, commit=False, buffered=False):
         """
         Insert data
         :param bind:
@@ -262,31 +769,237 @@ class DataBaseHelper(object):
         :param tb_name: indicates the table name
         :param data: indicates data
         :param commit: indicates whether to submit the transaction
-        :return: indicates the id of the inserted data
+        :param buffered: inside db.trans(buffered=True), queue the row instead of inserting it,
+                         the id of a queued row is not known
+        :return: indicates the id of the inserted data, True when the row is queued
         """
         # cls.allow_sharp()
-        tb_name = cls.filter_sql_injection(tb_name)
-        sql = "INSERT INTO " + tb_name + " ("
-        for key in data.keys():
-            sql += "`%s`" % key + ","
-        sql = sql[0:-1]
-        sql += ") VALUES ("
-        for key in data.keys():
-            sql += ":" + key + ","
-        sql = sql[0:-1]
-        sql += ")"
+        if buffered and not commit and cls.buffer_insert(tb_name, data, app=app, bind=bind):
+            return True
+        cls.flush_inserts()
+        timer = cls.metrics.timer('table', tb_name)
+        sql = cls.prepare_create(tb_name, data, app=app, bind=bind)
         try:
+            if timer:
+                timer.lap('render')
             if app and bind:
-                bind = cls.db.get_engine(app, bind=bind)
+                bind = cls.get_engine(app, bind)
                 result = cls.db.session.execute(sql, data, bind=bind)
             else:
                 result = cls.db.session.execute(sql, data)
             if commit:
                 cls.db.session.commit()
-            return result.lastrowid
         except Exception as e:
-            cls.print("Failed to execute sql: < %s %s >! Cause: %s" % (sql, str(data), str(e)))
+            if timer:
+                timer.done(error=e, params=data)
+            cls.print("Failed to execute sql: < %s %s >! Cause: %s", sql, data, e)
             return None
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=1, params=data)
+        return result.lastrowid
+
+    @classmethod
+    def begin_buffer(cls, size=1000):
+        """
+        Start queueing execute_create rows in the current session, used by db.trans(buffered=True).
+        A nested call keeps the open buffer and its queued rows, only the outermost end_buffer closes it.
+        :param size: number of queued rows that triggers a flush
+        """
+        info = cls.db.session.info
+        buffer = info.get(cls.insert_buffer_key)
+        if buffer is None:
+            info[cls.insert_buffer_key] = {'size': size, 'count': 0, 'groups': {}, 'depth': 1}
+        else:
+            buffer['depth'] += 1
+
+    @classmethod
+    def end_buffer(cls):
+        info = cls.db.session.info
+        buffer = info.get(cls.insert_buffer_key)
+        if buffer is None:
+            return
+        buffer['depth'] -= 1
+        if buffer['depth'] <= 0:
+            del info[cls.insert_buffer_key]
+
+    @classmethod
+    def buffer_insert(cls, tb_name, data, app=None, bind=None):
+        """
+        Queue a row when the session has an insert buffer, rows are grouped by bind, table and column set
+        :return: whether the row was queued
+        """
+        buffer = cls.db.session.info.get(cls.insert_buffer_key)
+        if buffer is None:
+            return False
+        cls.prepare_create(tb_name, data, app=app, bind=bind)  # Validate now rather than at flush
+        key = (bind if app and bind else None, tb_name, tuple(data.keys()))
+        group = buffer['groups'].get(key)
+        if group is None:
+            group = buffer['groups'][key] = (app, [])
+        group[1].append(dict(data))
+        buffer['count'] += 1
+        if buffer['count'] >= buffer['size']:
+            cls.flush_inserts()
+        return True
+
+    @classmethod
+    def flush_inserts(cls, sql_id=None, session=None):
+        """
+        Insert the queued rows with execute_create_many, group by group in the order they were first queued.
+        Called before every other read and write of the session and before commit.
+        :param sql_id: a read of sql_id only flushes when it declares no tables or one of them has queued rows
+        """
+        buffer = (session or cls.db.session).info.get(cls.insert_buffer_key)
+        if not buffer or not buffer['groups']:
+            return
+        if sql_id is not None:
+            meta = cls.get_cache_meta(sql_id)
+            if meta and meta.get('tables'):
+                tables = {cls.normalize_table(table) for table in meta['tables']}
+                if not any(cls.normalize_table(key[1]) in tables for key in buffer['groups']):
+                    return
+        groups = buffer['groups']
+        buffer['groups'] = {}
+        buffer['count'] = 0
+        for (bind, tb_name, _), (app, rows) in groups.items():
+            try:
+                cls.execute_create_many(tb_name, rows, chunk_size=buffer['size'], app=app, bind=bind, raise_errors=True)
+            except Exception as e:
+                raise Exception("Failed to insert the buffered rows of %s" % tb_name) from e
+
+    @classmethod
+    def before_commit(cls, session):
+        cls.flush_inserts(session=session)
+
+    @classmethod
+    def get_insert_sql(cls, tb_name, keys, rows=None):
+        """
+        Generate insert statement
+        :param tb_name: indicates the table name
+        :param keys: column names
+        :param rows: generates a multi-row VALUES list of that many rows, the bind names of the nth row are suffixed with _n
+        :return:
+        """
+        keys = [cls.validate_identifier(key) for key in keys]
+        sql = "INSERT INTO " + tb_name + " (" + ",".join("`%s`" % key for key in keys) + ") VALUES "
+        if rows is None:
+            return sql + "(" + ",".join(":" + key for key in keys) + ")"
+        return sql + ",".join(
+            "(" + ",".join(":%s_%d" % (key, i) for key in keys) + ")" for i in range(rows)
+        )
+
+    @classmethod
+    def get_dialect(cls, app=None, bind=None):
+        if app and bind:
+            return cls.get_engine(app, bind).dialect
+        return cls.db.engine.dialect
+
+    @classmethod
+    def get_param_limit(cls, dialect):
+        """
+        Maximum number of bind params in one statement of the dialect
+        """
+        if dialect.name == 'sqlite' and getattr(dialect.dbapi, 'sqlite_version_info', (0,)) >= (3, 32):
+            return 32766
+        return cls.param_limits.get(dialect.name, cls.param_limits['default'])
+
+    @classmethod
+    def supports_returning(cls, dialect):
+        """
+        Whether INSERT ... RETURNING is available on the dialect
+        """
+        if dialect.name == 'postgresql':
+            return True
+        if dialect.name == 'sqlite':
+            return getattr(dialect.dbapi, 'sqlite_version_info', (0,)) >= (3, 35)
+        if dialect.name == 'mysql':
+            return getattr(dialect, '_is_mariadb', False) and (dialect.server_version_info or (0,)) >= (10, 5)
+        return False
+
+    @classmethod
+    def group_rows(cls, rows):
+        """
+        Group dicts by their key set, keeping the order in which each key set first appears
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row.keys()), []).append(row)
+        return groups
+
+    @classmethod
+    def execute_create_many(cls, tb_name, rows, chunk_size=1000, app=None, bind=None, commit=False, return_ids=False, id_field='id', raise_errors=False):
+        """
+        Insert many rows in batches
+        Rows are grouped by their key set, every group builds its INSERT once and sends chunk_size rows per round trip.
+        Groups are inserted one after another, so rows with different key sets are not inserted in their original order.
+        :param bind:
+        :param app:
+        :param tb_name: indicates the table name
+        :param rows: list of dicts
+        :param chunk_size: number of rows per statement
+        :param commit: indicates whether to submit the transaction
+        :param return_ids: also return the ids of the inserted rows, uses INSERT ... RETURNING where the dialect supports it
+        :param id_field: column returned when return_ids is set
+        :param raise_errors: raise the database error instead of returning None
+        :return: number of inserted rows, or (number, ids) when return_ids is set, ids is None if the dialect can't return them
+        """
+        cls.flush_inserts()
+        timer = cls.metrics.timer('table', tb_name)
+        tb_name = cls.validate_identifier(tb_name)
+        cls.invalidate_table(tb_name)
+        returning = False
+        param_limit = None
+        if return_ids:
+            id_field = cls.validate_identifier(id_field)
+            dialect = cls.get_dialect(app=app, bind=bind)
+            returning = cls.supports_returning(dialect)
+            param_limit = cls.get_param_limit(dialect)
+        bind_name = bind
+        if app and bind:
+            bind = cls.get_engine(app, bind)
+
+        count = 0
+        ids = []
+        sql = None
+        try:
+            for keys, group in cls.group_rows(rows).items():
+                cls.check_columns(tb_name, keys, app=app, bind=bind_name)
+                step = chunk_size
+                if returning:
+                    # Every row of the multi-row VALUES binds one param per column
+                    step = max(1, min(chunk_size, param_limit // max(len(keys), 1)))
+                for start in range(0, len(group), step):
+                    chunk = group[start:start + step]
+                    if returning:
+                        # Multi-row VALUES so that one statement returns the ids of the whole chunk
+                        sql = cls.get_insert_sql(tb_name, keys, rows=len(chunk)) + " RETURNING %s" % id_field
+                        data = {"%s_%d" % (key, i): row[key] for i, row in enumerate(chunk) for key in keys}
+                    else:
+                        sql = cls.get_statement(('create', tb_name, keys), lambda: cls.get_insert_sql(tb_name, keys))
+                        data = chunk
+                    if bind:
+                        result = cls.db.session.execute(sql, data, bind=bind)
+                    else:
+                        result = cls.db.session.execute(sql, data)
+                    if returning:
+                        ids.extend(item[0] for item in result.fetchall())
+                    count += len(chunk)
+            if commit:
+                cls.db.session.commit()
+        except Exception as e:
+            if timer:
+                timer.done(error=e)
+            cls.print("Failed to execute sql: < %s >! Cause: %s", sql, e)
+            if raise_errors:
+                raise
+            return None
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=count)
+        if not return_ids:
+            return count
+        return count, ids if returning else None
 
     @classmethod
     def execute_delete(cls, tb_name, where, logic=False, app=None, bind=None, commit=False, exclude=None):
@@ -300,33 +1013,229 @@ class DataBaseHelper(object):
         :param commit: indicates whether to submit the transaction
         :return: indicates the number of deleted items
         """
-        tb_name = cls.filter_sql_injection(tb_name)
-        sql = "DELETE FROM " + tb_name
-        if logic:
-            if not cls.logic_delete_flag:
-                raise Exception("Logic delete flag is not defined")
-            sql = "UPDATE %s SET %s=1" % (tb_name, cls.logic_delete_flag)
-        sql = cls.set_where_phrase(sql, where)
-        sql = cls.set_exclude_phrase(sql, exclude)
-        where = cls.fullfilled_data({}, where, exclude=exclude)
+        cls.flush_inserts()
+        timer = cls.metrics.timer('table', tb_name)
+        sql, data = cls.prepare_delete(tb_name, where, logic=logic, exclude=exclude, app=app, bind=bind)
         try:
+            if timer:
+                timer.lap('render')
+            chunks = cls.split_in_params(data, where, app=app, bind=bind)
             if app and bind:
-                bind = cls.db.get_engine(app, bind=bind)
-                result = cls.db.session.execute(sql, where, bind=bind)
-            else:
-                result = cls.db.session.execute(sql, where)
+                bind = cls.get_engine(app, bind)
+            rowcount = 0
+            for params in chunks:
+                if app and bind:
+                    result = cls.db.session.execute(sql, params, bind=bind)
+                else:
+                    result = cls.db.session.execute(sql, params)
+                rowcount += result.rowcount
             if commit:
                 cls.db.session.commit()
-            return result.rowcount
         except Exception as e:
-            cls.print("Failed to execute sql: < %s %s >! Cause: %s" % (sql, str(where), str(e)))
+            if timer:
+                timer.done(error=e, params=data)
+            cls.print("Failed to execute sql: < %s %s >! Cause: %s", sql, data, e)
+            return None
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=rowcount, params=data)
+        return rowcount
+
+    @classmethod
+    def cache_sql(cls, sql_id, tables, ttl=None):
+        """
+        Declare the tables sql_id reads so its results can be cached, same as tables/cache_ttl in the yml file
+        """
+        cls.cached_sqls[sql_id] = {'tables': tables, 'cache_ttl': ttl}
+
+    @classmethod
+    def get_cache_meta(cls, sql_id):
+        meta = cls.cached_sqls.get(sql_id)
+        if meta is None:
+            meta = Loader.loader.get_sql_meta(sql_id)
+        return meta
+
+    @staticmethod
+    def normalize_table(tb_name):
+        return tb_name.replace('`', '').replace('"', '').strip().lower()
+
+    @classmethod
+    def result_cache_key(cls, sql_id, params, options, bind, *variant):
+        """
+        Tagged key of the result cache and its ttl, None when the result of sql_id can't be cached right now
+        Tables written in the current transaction are read from the database until it ends.
+        """
+        if not cls.result_cache_enabled:
+            return None
+        meta = cls.get_cache_meta(sql_id)
+        if not meta or not meta.get('tables'):
             return None
+        tables = [cls.normalize_table(table) for table in meta['tables']]
+        dirty = cls.db.session.info.get(cls.dirty_tables_key)
+        if dirty and dirty.intersection(tables):
+            return None
+        params_key, options_key = make_key(params), make_key(options)
+        if params_key is None or options_key is None:
+            return None
+        key = (sql_id, params_key, options_key, bind) + variant
+        return cls.result_cache.tag(key, tables), meta.get('cache_ttl')
+
+    @classmethod
+    def invalidate_table(cls, tb_name):
+        """
+        Drop the cached results depending on tb_name, called by every write
+        """
+        # Replicas may lag behind the write, the rest of the session reads from the primary
+        cls.db.session.info[cls.pin_primary_key] = True
+        if not cls.result_cache_enabled:
+            return
+        table = cls.normalize_table(tb_name)
+        cls.result_cache.invalidate(table)
+        cls.db.session.info.setdefault(cls.dirty_tables_key, set()).add(table)
+
+    @classmethod
+    def after_commit(cls, session):
+        """
+        Invalidate the written tables again once the transaction commits,
+        results cached by other sessions in the meantime were read before the commit
+        """
+        for table in session.info.pop(cls.dirty_tables_key, ()):
+            cls.result_cache.invalidate(table)
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop(cls.dirty_tables_key, None)
+        buffer = session.info.get(cls.insert_buffer_key)
+        if buffer:
+            buffer['groups'] = {}
+            buffer['count'] = 0
+
+    @classmethod
+    def invalidate_sqls(cls, sql_ids=None):
+        """
+        Drop the cached clauses, totals and results of sql_ids, of every sql when None.
+        Registered with SqlLoader.on_reload.
+        """
+        if sql_ids is None:
+            cls.clause_cache.clear()
+            cls.count_cache.clear()
+            cls.result_cache.clear()
+            return
+        cls.clause_cache.delete_where(lambda key: key[0] in sql_ids)
+        cls.count_cache.delete_where(lambda key: key[0] in sql_ids)
+        cls.result_cache.delete_sqls(sql_ids)
+
+    @classmethod
+    def listen_session_events(cls):
+        if not event.contains(cls.db.session, 'after_commit', cls.after_commit):
+            event.listen(cls.db.session, 'after_commit', cls.after_commit)
+            event.listen(cls.db.session, 'before_commit', cls.before_commit)
+            event.listen(cls.db.session, 'after_rollback', cls.after_rollback)
+
+    @classmethod
+    def get_clause(cls, sql_id, options=None, limit_one=False, count=False, expanding=()):
+        """
+        Render sql_id with options and wrap it in a text() construct.
+        Repeated (sql_id, options) pairs reuse the same construct, skipping both Jinja rendering and bind param parsing.
+        :param sql_id:
+        :param options: dynamic sql conditions
+        :param limit_one: wrap the sql in SELECT * FROM (...) LIMIT 1
+        :param count: wrap the sql in SELECT COUNT(*)
+        :param expanding: bind params holding a list, written as IN :param in the sql
+        :return: TextClause
+        """
+        def build():
+            clause = text(Loader.loader.preload_sql(sql_id, options=options, limit_one=limit_one, count=count))
+            if expanding:
+                clause = clause.bindparams(*[bindparam(name, expanding=True) for name in expanding])
+            return clause
+
+        key = make_key(options)
+        if key is None:
+            return build()
+        key = (sql_id, limit_one, count, key, expanding)
+        clause = cls.clause_cache.get(key)
+        if clause is None:
+            loader = Loader.loader
+            generation = loader.generation
+            clause = build()
+            # A reload between build() and here may have invalidated the sql the clause was built from
+            with loader.reload_lock:
+                if generation == loader.generation:
+                    cls.clause_cache.set(key, clause)
+        return clause
+
+    @classmethod
+    def use_primary(cls):
+        """
+        Send the remaining reads of the current session to the primary
+        """
+        cls.db.session.info[cls.pin_primary_key] = True
+
+    @classmethod
+    def choose_replica(cls):
+        """
+        Read replica of the next read without bind, None for the primary:
+        when no replica is configured or healthy, inside db.trans() and after a write of the session
+        """
+        if not cls.read_replicas:
+            return None
+        info = cls.db.session.info
+        if info.get(cls.pin_primary_key) or info.get(cls.trans_depth_key):
+            return None
+        now = time.monotonic()
+        healthy = [bind for bind in cls.read_replicas if cls.replica_down_until.get(bind, 0) <= now]
+        if not healthy:
+            return None
+        if cls.replica_strategy == 'least_loaded':
+            return min(healthy, key=lambda bind: cls.replica_load.get(bind, 0))
+        return healthy[next(cls.replica_counter) % len(healthy)]
+
+    @classmethod
+    def execute_read(cls, clause, params=None, app=None, primary=False):
+        """
+        Execute a read without bind on a read replica, or on the primary (see choose_replica).
+        A read failing on a replica runs again on the primary, if it succeeds there the replica is skipped
+        for DB_HELPER_REPLICA_RETRY_AFTER seconds.
+        :param primary: read from the primary anyway, e.g. results stored in the result cache:
+            a lagging replica read right after a write would cache stale rows under the new table version
+        """
+        replica = None if primary else cls.choose_replica()
+        if replica is None:
+            return cls.db.session.execute(clause, params)
+        with cls.replica_lock:
+            cls.replica_load[replica] = cls.replica_load.get(replica, 0) + 1
+        try:
+            return cls.db.session.execute(clause, params, bind=cls.get_engine(app, replica))
+        except Exception as e:
+            cls.print("Failed to read from replica %s, retrying on the primary! Cause :%s", replica, e)
+        finally:
+            with cls.replica_lock:
+                cls.replica_load[replica] -= 1
+        result = cls.db.session.execute(clause, params)
+        cls.replica_down_until[replica] = time.monotonic() + cls.replica_retry_after
+        return result
+
+    @classmethod
+    def row_converter(cls, keys, return_obj=True):
+        """
+        Build the function converting a result row, keys are resolved once per result instead of once per row
+        :param keys: column names of the result
+        :param return_obj: True for DBData, False for dict, 'row' for DBRow
+        :return:
+        """
+        keys = list(keys)
+        if return_obj == 'row':
+            keymap = {key: index for index, key in enumerate(keys)}
+            return lambda item: DBRow(keymap, tuple(item))
+        row_type = DBData if return_obj else dict
+        return lambda item: row_type(zip(keys, item))
 
     @classmethod
     def execute_sql(cls, sql_id, params=None, options: typing.Dict[str, str] = None, app=None, bind=None, return_obj=True):
         """
         General methods of dynamic sql
-        :param return_obj: Returns Dict or DBData
+        :param return_obj: Returns Dict or DBData, 'row' returns compact DBRow
         :param bind:
         :param app:
         :param sql_id:
@@ -334,36 +1243,618 @@ class DataBaseHelper(object):
         :param options: dynamic sql conditions
         :return:
         """
-        preloaded_sql = Loader.loader.preload_sql(sql_id, options=options)
+        cls.flush_inserts(sql_id)
+        cache_key = cls.result_cache_key(sql_id, params, options, bind)
+        if cache_key:
+            cached = cls.result_cache.get(cache_key[0])
+            if cached is not None:
+                convert = cls.row_converter(cached[0], return_obj)
+                return [convert(item) for item in cached[1]]
+
+        timer = cls.metrics.timer('sql', sql_id)
+        flight_key = cls.single_flight_key(sql_id, params, options, bind)
+        shared = False
+        if flight_key is None:
+            keys, rows, error = cls.fetch_rows(sql_id, params, options, app, bind, cache_key, timer)
+        else:
+            (keys, rows, error), shared = cls.single_flight.do(
+                flight_key, lambda: cls.fetch_rows(sql_id, params, options, app, bind, cache_key, timer)
+            )
+        if error is not None:
+            if timer:
+                timer.done(error=error, params=params)
+            return []
+        # Every caller converts the fetched rows into its own objects, shared results are never aliased
+        convert = cls.row_converter(keys, return_obj)
+        converted = [convert(item) for item in rows]
+        if timer:
+            if not shared:
+                timer.lap('fetch')
+            timer.done(rows=len(converted), params=params)
+        return converted
+
+    @classmethod
+    def single_flight_key(cls, sql_id, params, options, bind):
+        """
+        Key of execute_sql shared by identical concurrent calls, None when the call must run on its own:
+        single flight disabled, unhashable params/options, inside db.trans() or after a write of the session
+        """
+        if not cls.single_flight_enabled:
+            return None
+        info = cls.db.session.info
+        if info.get(cls.pin_primary_key) or info.get(cls.trans_depth_key):
+            return None
+        params_key, options_key = make_key(params), make_key(options)
+        if params_key is None or options_key is None:
+            return None
+        return sql_id, params_key, options_key, bind
+
+    @classmethod
+    def fetch_rows(cls, sql_id, params=None, options=None, app=None, bind=None, cache_key=None, timer=None):
+        """
+        Execute dynamic sql and fetch all its rows, storing them in the result cache under cache_key
+        :return: (keys, rows, error), error is the exception when the execution fails
+        """
+        preloaded_sql = cls.get_clause(sql_id, options=options)
         try:
+            if timer:
+                timer.lap('render')
             # Multiple databases | specifies that the database executes sql
             if app and bind:
-                bind = cls.db.get_engine(app, bind=bind)
-                result = cls.db.session.execute(preloaded_sql, params, bind=bind).fetchall()
+                bind = cls.get_engine(app, bind)
+                result = cls.db.session.execute(preloaded_sql, params, bind=bind)
             else:
-                cls.print('execute <%s>, params: %s' % (sql_id, str(params)))
-                result = cls.db.session.execute(preloaded_sql, params).fetchall()
+                cls.print('execute <%s>, params: %s', sql_id, params)
+                result = cls.execute_read(preloaded_sql, params, app=app, primary=cache_key is not None)
+            if timer:
+                timer.lap('execute')
+            keys = list(result.keys())
+            rows = result.fetchall()
         except Exception as e:
-            cls.print("Failed to execute sql: %s %s! Cause :%s" % (preloaded_sql, str(params), str(e)))
-            return []
+            cls.print("Failed to execute sql: %s %s! Cause :%s", preloaded_sql, params, e)
+            return None, None, e
         else:
-            cls.print("Current sql execution: %s %s" % (preloaded_sql, str(params)))
-        if return_obj:
-            return [DBData(zip(item.keys(), item)) for item in result]
-        return [dict(zip(item.keys(), item)) for item in result]
+            cls.print("Current sql execution: %s %s", preloaded_sql, params)
+        if cache_key:
+            cls.result_cache.set(cache_key[0], (keys, [tuple(item) for item in rows]), cache_key[1])
+        return keys, rows, None
+
+    @classmethod
+    def open_stream(cls, sql_id, params=None, options=None, app=None, bind=None):
+        """
+        Execute dynamic sql with a server-side cursor, the rows are left to the caller to fetch and the result to close.
+        Shared by select_iter, export_chunks and select_columns.
+        :return: (result, timer), result is None when the execution fails
+        """
+        cls.flush_inserts(sql_id)
+        timer = cls.metrics.timer('sql', sql_id)
+        preloaded_sql = cls.get_clause(sql_id, options=options).execution_options(stream_results=True)
+        try:
+            if timer:
+                timer.lap('render')
+            if app and bind:
+                result = cls.db.session.execute(preloaded_sql, params, bind=cls.get_engine(app, bind))
+            else:
+                cls.print('execute <%s>, params: %s', sql_id, params)
+                result = cls.execute_read(preloaded_sql, params, app=app)
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=params)
+            cls.print("Failed to execute sql: %s %s! Cause :%s", preloaded_sql, params, e)
+            return None, None
+        if timer:
+            timer.lap('execute')
+        return result, timer
+
+    @classmethod
+    def select_iter(cls, sql_id, params=None, options: typing.Dict[str, str] = None, app=None, bind=None, return_obj=True, chunk_size=1000):
+        """
+        Stream the rows of dynamic sql with a server-side cursor.
+        Rows are fetched chunk_size at a time, so memory is bounded by the chunk instead of the whole result
+        :param return_obj: Yields Dict or DBData, 'row' yields compact DBRow
+        :param bind:
+        :param app:
+        :param sql_id:
+        :param params: Search criteria
+        :param options: dynamic sql conditions
+        :param chunk_size: number of rows fetched from the cursor per round trip
+        :return: generator of rows
+        """
+        result, timer = cls.open_stream(sql_id, params, options, app=app, bind=bind)
+        if result is None:
+            return
+        convert = cls.row_converter(result.keys(), return_obj)
+        count = 0
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                count += len(rows)
+                for item in rows:
+                    yield convert(item)
+        finally:
+            result.close()
+            if timer:
+                # Includes the time the caller spends consuming the rows
+                timer.lap('fetch')
+                timer.done(rows=count, params=params)
+
+    @classmethod
+    def export_chunks(cls, sql_id, params=None, options: typing.Dict[str, str] = None, fmt='csv', app=None, bind=None, chunk_size=1000, header=True, **fmtparams):
+        """
+        Serialize the rows of dynamic sql chunk by chunk as they are fetched from a server-side cursor
+        :return: generator of (text, number of rows in text)
+        """
+        result, timer = cls.open_stream(sql_id, params, options, app=app, bind=bind)
+        if result is None:
+            return
+        keys = list(result.keys())
+        count = 0
+        try:
+            if fmt == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, **fmtparams)
+                if header:
+                    writer.writerow(keys)
+                    yield buffer.getvalue(), 0
+                while True:
+                    rows = result.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    buffer.seek(0)
+                    buffer.truncate()
+                    writer.writerows(rows)
+                    count += len(rows)
+                    yield buffer.getvalue(), len(rows)
+            else:
+                # The C encoder serializes a short-lived dict faster than a per-cell key template
+                encode = json.JSONEncoder(default=str, ensure_ascii=False).encode
+                while True:
+                    rows = result.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    count += len(rows)
+                    yield ''.join([encode(dict(zip(keys, item))) + '\n' for item in rows]), len(rows)
+        finally:
+            result.close()
+            if timer:
+                timer.lap('fetch')
+                timer.done(rows=count, params=params)
+
+    @classmethod
+    def export_sql(cls, sql_id, params=None, options: typing.Dict[str, str] = None, fmt='csv', out=None, app=None, bind=None, chunk_size=1000, header=True, **fmtparams):
+        """
+        Export the rows of dynamic sql as CSV or JSON Lines without loading the result,
+        memory is bounded by one chunk of rows whatever the size of the result
+        :param fmt: 'csv' or 'jsonl'
+        :param out: writable text file object, when None a generator of str is returned for a streaming response:
+                    Response(stream_with_context(DataBaseHelper.export_sql(...)), mimetype='text/csv')
+        :param chunk_size: number of rows fetched and written at a time
+        :param header: write the column names as the first csv line
+        :param fmtparams: csv.writer options, e.g. delimiter=';'
+        :return: number of exported rows when writing to out, else the generator
+        """
+        if fmt not in ('csv', 'jsonl'):
+            raise ValueError('Unsupported export format: %s' % fmt)
+        chunks = cls.export_chunks(
+            sql_id, params, options, fmt=fmt, app=app, bind=bind, chunk_size=chunk_size, header=header, **fmtparams
+        )
+        if out is None:
+            return (text for text, _ in chunks)
+        count = 0
+        for text, rows in chunks:
+            out.write(text)
+            count += rows
+        return count
+
+    @staticmethod
+    def column_buffer(values):
+        """
+        Storage of a result column chosen from its first values: array('q') for integers, array('d') for floats,
+        a list for anything else or when the column starts with NULL
+        """
+        for value in values:
+            if value is None or isinstance(value, bool):
+                break
+            if isinstance(value, int):
+                return array('q')
+            if isinstance(value, float):
+                return array('d')
+            break
+        return []
+
+    @staticmethod
+    def extend_column(column, values):
+        """
+        Append values to a column buffer, an array that can't hold them (NULL, text, overflow) becomes a list
+        :return: the buffer holding the column
+        """
+        if isinstance(column, list):
+            column.extend(values)
+            return column
+        size = len(column)
+        try:
+            column.extend(values)
+            return column
+        except (TypeError, OverflowError):
+            del column[size:]
+            column = column.tolist()
+            column.extend(values)
+            return column
 
     @classmethod
-    def select_one(cls, sql_id, params=None, options: typing.Dict[str, str] = None, app=None, bind=None, return_obj=True):
+    def select_columns(cls, sql_id, params=None, options: typing.Dict[str, str] = None, app=None, bind=None, chunk_size=10000, numpy=False):
+        """
+        Query dynamic sql into columns instead of rows, for aggregations over many rows
+        Rows are fetched chunk_size at a time with a server-side cursor and appended column by column,
+        integer and float columns are stored in typed arrays, so no per-row or per-cell object is kept.
+        :param chunk_size: number of rows fetched from the cursor per round trip
+        :param numpy: return numpy arrays, int64/float64 for the typed columns and object arrays for the rest
+        :return: DBData {column: array('q') | array('d') | list}, empty when the execution fails
+        """
+        if numpy:
+            import numpy as np  # Optional dependency, only needed for numpy=True
+
+        result, timer = cls.open_stream(sql_id, params, options, app=app, bind=bind)
+        if result is None:
+            return DBData()
+        keys = list(result.keys())
+        columns = None
+        count = 0
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                count += len(rows)
+                values = list(zip(*rows))
+                if columns is None:
+                    columns = [cls.column_buffer(column_values) for column_values in values]
+                columns = [cls.extend_column(column, column_values) for column, column_values in zip(columns, values)]
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=params)
+            cls.print("Failed to fetch the rows of %s %s! Cause :%s", sql_id, params, e)
+            return DBData()
+        finally:
+            result.close()
+
+        if columns is None:
+            columns = [[] for _ in keys]
+        if numpy:
+            dtypes = {'q': np.int64, 'd': np.float64}
+            columns = [
+                np.frombuffer(column, dtype=dtypes[column.typecode]) if isinstance(column, array)
+                else np.array(column, dtype=object)
+                for column in columns
+            ]
+        if timer:
+            timer.lap('fetch')
+            timer.done(rows=count, params=params)
+        return DBData(zip(keys, columns))
+
+    @classmethod
+    def execute_first(cls, sql_id, params=None, options: typing.Dict[str, str] = None, app=None, bind=None, limit=False):
+        """
+        Execute dynamic sql and return its first row, the rest of the result is discarded.
+        Without limit the database still produces the whole result, only the first row is read from it
+        :param limit: wrap the rendered sql in SELECT * FROM (...) LIMIT 1 so the database stops after one row
+        :return: (keys, row), row is None when nothing matches or the execution fails
+        """
+        cls.flush_inserts(sql_id)
         options = cls.get_params_without_paginated(options)  # No paging required
-        result = cls.execute_sql(sql_id, params, options, app=app, bind=bind, return_obj=return_obj)
-        return DBData(result[0] if result else {})
+        cache_key = cls.result_cache_key(sql_id, params, options, bind, 'first', limit)
+        if cache_key:
+            cached = cls.result_cache.get(cache_key[0])
+            if cached is not None:
+                return cached
+
+        timer = cls.metrics.timer('sql', sql_id)
+        preloaded_sql = cls.get_clause(sql_id, options=options, limit_one=limit)
+        try:
+            if timer:
+                timer.lap('render')
+            if app and bind:
+                bind = cls.get_engine(app, bind)
+                result = cls.db.session.execute(preloaded_sql, params, bind=bind)
+            else:
+                cls.print('execute <%s>, params: %s', sql_id, params)
+                result = cls.execute_read(preloaded_sql, params, app=app, primary=cache_key is not None)
+            if timer:
+                timer.lap('execute')
+            keys = result.keys()
+            row = result.first()
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=params)
+            cls.print("Failed to execute sql: %s %s! Cause :%s", preloaded_sql, params, e)
+            return None, None
+        else:
+            cls.print("Current sql execution: %s %s", preloaded_sql, params)
+        if timer:
+            timer.lap('fetch')
+            timer.done(rows=0 if row is None else 1, params=params)
+        if cache_key:
+            cls.result_cache.set(cache_key[0], (list(keys), None if row is None else tuple(row)), cache_key[1])
+        return keys, row
+
+    @classmethod
+    def select_one(cls, sql_id, params=None, options: typing.Dict[str, str] = None, app=None, bind=None, return_obj=True, limit=False):
+        """
+        Query the first row
+        :param return_obj: 'row' returns DBRow, otherwise DBData
+        :param limit: wrap the sql in SELECT * FROM (...) LIMIT 1
+        :return: the row, an empty DBData when nothing matches
+        """
+        keys, row = cls.execute_first(sql_id, params, options, app=app, bind=bind, limit=limit)
+        if row is None:
+            return DBData()
+        if return_obj == 'row':
+            return cls.row_converter(keys, return_obj)(row)
+        return DBData(zip(keys, row))
+
+    @classmethod
+    def select_scalar(cls, sql_id, params=None, options: typing.Dict[str, str] = None, app=None, bind=None, default=None, limit=False):
+        """
+        Query the first column of the first row, e.g. a COUNT(*)
+        :param default: returned when nothing matches
+        :param limit: wrap the sql in SELECT * FROM (...) LIMIT 1
+        """
+        _, row = cls.execute_first(sql_id, params, options, app=app, bind=bind, limit=limit)
+        return default if row is None else row[0]
+
+    @classmethod
+    def count_cache_key(cls, sql_id, params, options, bind):
+        """
+        Key of the total in count_cache, None when params or options can't be hashed
+        """
+        params_key, options_key = make_key(params), make_key(options)
+        if params_key is None or options_key is None:
+            return None
+        return sql_id, params_key, options_key, bind
+
+    @classmethod
+    def select_count(cls, sql_id, params=None, options: typing.Dict[str, typing.Union[str, int, None]] = None, app=None, bind=None, use_cache=True):
+        """
+        Count the rows of dynamic sql with SELECT COUNT(*) FROM (sql), paging options are ignored
+        :param use_cache: reuse the total counted within DB_HELPER_COUNT_CACHE_TTL seconds for the same params and options
+        :return: total, None when the execution fails
+        """
+        cls.flush_inserts(sql_id)
+        options = cls.get_params_without_paginated(options)
+        key = cls.count_cache_key(sql_id, params, options, bind) if use_cache else None
+        if key is not None:
+            total = cls.count_cache.get(key)
+            if total is not None:
+                return total
+
+        timer = cls.metrics.timer('sql', sql_id + ':count')
+        preloaded_sql = cls.get_clause(sql_id, options=options, count=True)
+        try:
+            if timer:
+                timer.lap('render')
+            if app and bind:
+                result = cls.db.session.execute(preloaded_sql, params, bind=cls.get_engine(app, bind))
+            else:
+                result = cls.execute_read(preloaded_sql, params, app=app)
+            total = result.scalar()
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=params)
+            cls.print("Failed to execute sql: %s %s! Cause :%s", preloaded_sql, params, e)
+            return None
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=1, params=params)
+        if key is not None:
+            cls.count_cache.set(key, total)
+        return total
+
+    @classmethod
+    def page_options(cls, options):
+        """
+        Copy of options with page/page_size defaulting to 1/10
+        :return: (options, page, page_size)
+        """
+        options = dict(options or {})
+        page = int(options.get(cls.page_param) or 1)
+        page_size = int(options.get(cls.page_size_param) or 10)
+        options[cls.page_param] = page
+        options[cls.page_size_param] = page_size
+        return options, page, page_size
+
+    @classmethod
+    def select_page(cls, sql_id, params=None, options: typing.Dict[str, typing.Union[str, int, None]] = None, app=None, bind=None, return_obj=True, use_cache=True):
+        """
+        Query one page together with the total number of rows
+        :param options: dynamic sql conditions, page/page_size default to 1/10
+        :param use_cache: reuse the cached total while paging through the same result
+        :return: DBData(rows=..., total=..., page=..., page_size=...)
+        """
+        options, page, page_size = cls.page_options(options)
+        rows = cls.execute_sql(sql_id, params, options, app=app, bind=bind, return_obj=return_obj)
+        total = cls.select_count(sql_id, params, options, app=app, bind=bind, use_cache=use_cache)
+        return DBData(rows=rows, total=total, page=page, page_size=page_size)
+
+    @classmethod
+    def encode_cursor(cls, value):
+        """
+        Encode the last keyset value as an opaque url-safe token
+        """
+        return base64.urlsafe_b64encode(json.dumps([value], default=str).encode('utf-8')).decode('ascii')
+
+    @classmethod
+    def decode_cursor(cls, token):
+        try:
+            return json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))[0]
+        except Exception:
+            raise ValueError('Invalid cursor: %s' % token)
+
+    @classmethod
+    def select_keyset(cls, sql_id, params=None, options: typing.Dict[str, typing.Union[str, int, None]] = None, cursor=None, last_value=None, app=None, bind=None, return_obj=True):
+        """
+        Keyset paging, the cost of a page doesn't grow with its depth like LIMIT offset,limit
+        options must contain the keyset column (unique, selected by the sql) and page_size, e.g. {"keyset": "id", "page_size": 20}
+        :param cursor: token returned with the previous page
+        :param last_value: the keyset value of the last row seen, instead of a cursor
+        :return: (rows, next_cursor), next_cursor is None on the last page
+        """
+        params, options = cls.keyset_options(params, options, cursor, last_value)
+        rows = cls.execute_sql(sql_id, params, options, app=app, bind=bind, return_obj=return_obj)
+        return rows, cls.next_cursor(rows, options)
+
+    @classmethod
+    def keyset_options(cls, params, options, cursor=None, last_value=None):
+        """
+        Copies of params and options of a keyset page, the last value is bound as :_keyset_cursor
+        :return: (params, options)
+        """
+        options = dict(options or {})
+        if not options.get(Loader.loader.keyset_param):
+            raise ValueError('The keyset column is required in options: %s' % Loader.loader.keyset_param)
+        if cursor is not None:
+            last_value = cls.decode_cursor(cursor)
+        params = dict(params or {})
+        params['_keyset_cursor'] = last_value
+        # Only the presence of the cursor is rendered, so every page shares the same cached clause
+        options[Loader.loader.keyset_cursor_param] = last_value is not None
+        return params, options
+
+    @classmethod
+    def next_cursor(cls, rows, options):
+        """
+        Cursor of the page after rows, None on the last page
+        """
+        page_size = int(options.get(cls.page_size_param) or 10)
+        if rows and len(rows) >= page_size:
+            return cls.encode_cursor(rows[-1][options[Loader.loader.keyset_param]])
+        return None
+
+    @classmethod
+    def select_in(cls, sql_id, param, values, params=None, options: typing.Dict[str, typing.Union[str, int, None]] = None, app=None, bind=None, return_obj=True, chunk_size=None):
+        """
+        Query dynamic sql filtering on a list of values, e.g. WHERE id IN :ids
+        A list longer than the chunk size of the dialect (DB_HELPER_IN_CHUNK_SIZES) is deduplicated and queried
+        chunk by chunk, the rows of the chunks are concatenated, so ORDER BY/LIMIT only apply within a chunk.
+        :param param: name of the bind param written as IN :param in the sql
+        :param values: list of values bound to param
+        :param chunk_size: overrides the chunk size of the dialect
+        :return: rows
+        """
+        cls.flush_inserts(sql_id)
+        cls.validate_identifier(param)
+        values = list(values)
+        chunk_size = chunk_size or cls.get_in_chunk_size(len(values), app=app, bind=bind)
+        if chunk_size and len(values) > chunk_size:
+            values = list(dict.fromkeys(values))
+        else:
+            chunk_size = max(len(values), 1)
+
+        timer = cls.metrics.timer('sql', sql_id)
+        preloaded_sql = cls.get_clause(sql_id, options=options, expanding=(param,))
+        rows = []
+        try:
+            if timer:
+                timer.lap('render')
+            if app and bind:
+                bind = cls.get_engine(app, bind)
+            for start in range(0, max(len(values), 1), chunk_size):
+                chunk_params = dict(params or {}, **{param: values[start:start + chunk_size]})
+                if app and bind:
+                    result = cls.db.session.execute(preloaded_sql, chunk_params, bind=bind)
+                else:
+                    result = cls.execute_read(preloaded_sql, chunk_params, app=app)
+                convert = cls.row_converter(result.keys(), return_obj)
+                rows.extend(convert(item) for item in result.fetchall())
+        except Exception as e:
+            if timer:
+                timer.done(error=e, params=params)
+            cls.print("Failed to execute sql: %s %s! Cause :%s", preloaded_sql, params, e)
+            return []
+        if timer:
+            timer.lap('execute')
+            timer.done(rows=len(rows), params=params)
+        return rows
 
     @classmethod
     def select_all(cls, sql_id, params=None, options: typing.Dict[str, typing.Union[str, int, None]] = None, app=None, bind=None, return_obj=True):
         return cls.execute_sql(sql_id, params, options, app=app, bind=bind, return_obj=return_obj)
 
+    @classmethod
+    def get_fanout_executor(cls):
+        if cls.fanout_executor is None:
+            with cls.fanout_lock:
+                if cls.fanout_executor is None:
+                    cls.fanout_executor = ThreadPoolExecutor(cls.fanout_workers, thread_name_prefix='flask_sql_pro')
+        return cls.fanout_executor
+
+    @classmethod
+    def execute_on_engine(cls, engine, clause, params, return_obj=True):
+        """
+        Execute a rendered clause on its own connection of the engine, outside of the scoped session
+        """
+        with engine.connect() as conn:
+            result = conn.execute(clause, params or {})
+            convert = cls.row_converter(result.keys(), return_obj)
+            return [convert(item) for item in result.fetchall()]
+
+    @classmethod
+    def select_all_across(cls, sql_id, params=None, options: typing.Dict[str, typing.Union[str, int, None]] = None, binds=None, app=None, return_obj=True, merge='concat', order_by=None, reverse=False, raise_errors=True):
+        """
+        Run the same dynamic sql on several binds in parallel, e.g. tenants sharded across databases.
+        The sql is rendered once, every bind runs on its own connection in a thread of a shared pool
+        (DB_HELPER_FANOUT_WORKERS), so it doesn't see uncommitted writes of the current session.
+        :param binds: bind names of SQLALCHEMY_BINDS, None stands for the default database
+        :param merge: 'concat' joins the rows in the order of binds,
+                      'ordered' merges rows already sorted by order_by on every bind,
+                      'dict' returns {bind: rows}
+        :param order_by: column the rows are sorted by, required by merge='ordered'
+        :param reverse: the rows are sorted in descending order
+        :param raise_errors: raise FanoutError when a bind fails, False returns the merged rows of the other binds
+                             together with the errors
+        :return: rows, (rows, {bind: exception}) when raise_errors is False
+        """
+        if merge not in ('concat', 'ordered', 'dict'):
+            raise ValueError('Unsupported merge: %s' % merge)
+        if merge == 'ordered' and not order_by:
+            raise ValueError('order_by is required by merge=ordered')
+        binds = list(binds or [])
+        timer = cls.metrics.timer('sql', sql_id)
+        preloaded_sql = cls.get_clause(sql_id, options=options)
+        if timer:
+            timer.lap('render')
+        engines = [cls.get_engine(app, bind) for bind in binds]
+        cls.print('execute <%s> on %s, params: %s', sql_id, binds, params)
+
+        executor = cls.get_fanout_executor()
+        futures = [executor.submit(cls.execute_on_engine, engine, preloaded_sql, params, return_obj) for engine in engines]
+        results = {}
+        errors = {}
+        for bind, future in zip(binds, futures):
+            try:
+                results[bind] = future.result()
+            except Exception as e:
+                errors[bind] = e
+                cls.print("Failed to execute sql on %s: %s %s! Cause :%s", bind, preloaded_sql, params, e)
+        if timer:
+            timer.lap('execute')
+            error = next(iter(errors.values()), None)
+            timer.done(rows=sum(len(rows) for rows in results.values()), error=error, params=params)
+        if errors and raise_errors:
+            raise FanoutError(sql_id, errors, results)
+
+        if merge == 'dict':
+            merged = results
+        elif merge == 'ordered':
+            merged = list(heapq.merge(*results.values(), key=lambda item: item[order_by], reverse=reverse))
+        else:
+            merged = [item for bind in binds if bind in results for item in results[bind]]
+        return merged if raise_errors else (merged, errors)
+
     @classmethod
     def flush(cls):
+        cls.flush_inserts()
         cls.db.session.flush()
 
     @classmethod
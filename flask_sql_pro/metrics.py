@@ -0,0 +1,177 @@
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets in seconds, the last bucket counts everything slower
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram(object):
+    """
+    Latency histogram with fixed buckets, percentiles are approximated by the upper bound of their bucket
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'buckets': list(zip(self.buckets + (float('inf'),), self.counts)),
+        }
+
+
+class QueryStats(object):
+    """
+    Counters and per-phase latency histograms of one sql_id or table
+    """
+    phases = ('render', 'execute', 'fetch', 'total')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.histograms = {phase: Histogram(buckets) for phase in self.phases}
+
+    def add(self, timings, total, rows=None, error=None):
+        self.calls += 1
+        if error is not None:
+            self.errors += 1
+        if rows:
+            self.rows += rows
+        for phase, seconds in timings.items():
+            self.histograms[phase].observe(seconds)
+        self.histograms['total'].observe(total)
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'rows': self.rows,
+            'latency': {phase: histogram.to_dict() for phase, histogram in self.histograms.items() if histogram.count},
+        }
+
+
+class QueryTimer(object):
+    """
+    Measures the phases of one execution, created by Metrics.timer only while metrics are enabled
+    """
+    __slots__ = ('metrics', 'kind', 'name', 'started', 'last', 'timings')
+
+    def __init__(self, metrics, kind, name):
+        self.metrics = metrics
+        self.kind = kind
+        self.name = name
+        self.started = self.last = time.perf_counter()
+        self.timings = {}
+
+    def lap(self, phase):
+        """
+        Charge the time since the previous lap to phase, repeated laps of a phase add up
+        """
+        now = time.perf_counter()
+        self.timings[phase] = self.timings.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def done(self, rows=None, error=None, params=None):
+        self.metrics.observe(self.kind, self.name, self.timings, time.perf_counter() - self.started, rows, error, params)
+
+
+class Metrics(object):
+    """
+    Execution metrics of DataBaseHelper, kind is 'sql' for sql_ids and 'table' for insert/update/delete.
+    While disabled, timer() returns None and nothing is measured.
+    Slow executions are logged with the flask_sql_pro.metrics logger,
+    hooks are called with a dict describing every execution.
+    """
+
+    def __init__(self, enabled=False, slow_query_threshold=None, hooks=None, buckets=DEFAULT_BUCKETS):
+        """
+        :param slow_query_threshold: seconds, executions taking longer are logged as warnings
+        :param hooks: callables receiving {'kind', 'name', 'timings', 'total', 'rows', 'error', 'params'}
+        """
+        self.enabled = enabled
+        self.slow_query_threshold = slow_query_threshold
+        self.hooks = list(hooks or [])
+        self.buckets = buckets
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def timer(self, kind, name):
+        if not self.enabled:
+            return None
+        return QueryTimer(self, kind, name)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def observe(self, kind, name, timings, total, rows=None, error=None, params=None):
+        with self._lock:
+            stats = self._stats.get((kind, name))
+            if stats is None:
+                stats = self._stats[(kind, name)] = QueryStats(self.buckets)
+            stats.add(timings, total, rows, error)
+
+        if self.slow_query_threshold is not None and total >= self.slow_query_threshold:
+            logger.warning('Slow %s <%s>: %.1f ms, params: %s', kind, name, total * 1000, params)
+        if self.hooks:
+            event = {
+                'kind': kind, 'name': name, 'timings': timings, 'total': total,
+                'rows': rows, 'error': error, 'params': params,
+            }
+            for hook in self.hooks:
+                try:
+                    hook(event)
+                except Exception:
+                    logger.exception('Metrics hook %r failed', hook)
+
+    def get(self, kind, name):
+        with self._lock:
+            stats = self._stats.get((kind, name))
+            return stats.to_dict() if stats is not None else None
+
+    def snapshot(self):
+        """
+        :return: {kind: {name: {'calls', 'errors', 'rows', 'latency': {phase: histogram}}}}
+        """
+        result = {}
+        with self._lock:
+            for (kind, name), stats in self._stats.items():
+                result.setdefault(kind, {})[name] = stats.to_dict()
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
@@ -1,13 +1,33 @@
+import json
+import logging
 import os
+import re
+import tempfile
 import threading
 import typing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import yaml
 import jinja2
 
+from flask_sql_pro.cache import LRUCache
+
+# libyaml based loader when PyYAML was built with it, several times faster than the pure-Python one
+YamlLoader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+
+def parse_sql_file(path: str) -> typing.Dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=YamlLoader) or {}
+
+
+logger = logging.getLogger(__name__)
+
 
 class GlobalData:
     sql_group = {}
+    # path: (sql_id prefix, (mtime_ns, size), sql_ids) of every loaded file
+    sql_files = {}
 
 
 class Loader:
@@ -33,66 +53,306 @@ class SqlLoader(metaclass=SingletonType):
     SQL_FILE_PATH = None
     page_param = None
     page_size_param = None
+    keyset_param = 'keyset'
+    keyset_cursor_param = 'cursor'
+    keyset_order_param = 'order'
+    keyset_key_pattern = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+    # Trailing ';', optionally followed by a line comment, removed before the sql is wrapped in a derived table
+    statement_end_pattern = re.compile(r";[ \t]*(--[^'\n]*)?$")
+    # Compiled templates shared by all requests, keyed by (sql_id, mode)
+    template_env = jinja2.Environment()
+    template_cache = LRUCache(512)
+    pagination_block = """
+            {% if limit and not offset %}
+                LIMIT {{ limit }}
+                {% elif limit and offset %}
+                LIMIT {{ offset }},{{ limit }}
+            {% endif %}
+            """
+    # (prefix, suffix) wrapped around the sql by each rendering mode
+    sql_wrappers = {
+        'page': ('', pagination_block),
+        'one': ('SELECT * FROM (\n', '\n) _one\nLIMIT 1'),
+        'count': ('SELECT COUNT(*) FROM (\n', '\n) _count'),
+        'keyset': (
+            'SELECT * FROM (\n',
+            """
+            ) _keyset
+            {% if _keyset_cursor %}
+            WHERE {{ _keyset_key }} {{ '<' if _keyset_desc else '>' }} :_keyset_cursor
+            {% endif %}
+            ORDER BY {{ _keyset_key }} {{ 'DESC' if _keyset_desc else 'ASC' }}
+            LIMIT {{ _keyset_limit }}
+            """,
+        ),
+        # The sql places {{ keyset_where }} and {{ keyset_order }} itself, only the LIMIT is appended
+        'keyset_inline': ('', '\nLIMIT {{ _keyset_limit }}'),
+    }
+    # Sql referencing keyset_where seeks inside its own query instead of being wrapped in a derived table
+    keyset_hook_pattern = re.compile(r'\{\{\s*keyset_where\s*\}\}')
+    # Inner ORDER BY/LIMIT of a sql wrapped for keyset paging, the wrapper cannot push its predicate past them
+    keyset_inner_pattern = re.compile(r'\b(ORDER\s+BY|LIMIT|FETCH)\b', re.IGNORECASE)
+    reload_listeners = []
+    # Bumped after every swap of loaded sql, under reload_lock. Templates and clauses built while it moved
+    # may come from the previous sql and are not cached
+    generation = 0
+    reload_lock = threading.RLock()
+    watcher = None
+    preload_workers = 1
+    preload_executor = 'process'
+    catalog_cache_file = None
+    catalog_cache_version = 2
 
     def __init__(self):
         self.sql_data = SqlLoader.get_sql_data(self.SQL_FILE_PATH)
 
     @classmethod
-    def preload_all_sqls(cls):
+    def on_reload(cls, listener):
         """
-        Preloac all sqls into memory
+        Register a callable that is invoked after sql files are reloaded,
+        with the set of changed sql_ids, or None when everything was reloaded
         """
-        for _path, _, files in os.walk(cls.SQL_FILE_PATH):
-            if os.path.samefile(_path, cls.SQL_FILE_PATH):  # root path
-                for _f in files:
-                    c_file = os.path.join(_path, _f)
-                    c_file_name = _f.replace('.yml', '')
+        if listener not in cls.reload_listeners:
+            cls.reload_listeners.append(listener)
+        return listener
 
-                    with open(c_file, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        sql_group = yaml.load(content, Loader=yaml.FullLoader)
-                        if not sql_group:
-                            continue
+    def reload(self):
+        """
+        Drop every loaded sql and compiled template, sql files are read again on the next call
+        """
+        with self.reload_lock:
+            self.sql_data = SqlLoader.get_sql_data(self.SQL_FILE_PATH)
+            GlobalData.sql_group = {}
+            GlobalData.sql_files = {}
+            self.invalidate(None)
+        return True
 
-                        for _k in sql_group.keys():
-                            _sql_id = '%s.%s' % (c_file_name, _k)
-                            GlobalData.sql_group[_sql_id] = sql_group[_k]
-                continue
+    def invalidate(self, changed: typing.Optional[typing.Set[str]]):
+        """
+        Move to the next generation and drop the templates of the changed sql_ids, of every sql when None,
+        then notify the reload listeners. Called under reload_lock right after the sql is swapped.
+        """
+        SqlLoader.generation += 1
+        if changed is None:
+            self.template_cache.clear()
+        else:
+            self.template_cache.delete_where(lambda key: key[0] in changed)
+        for listener in self.reload_listeners:
+            listener(changed)
 
-            relative_path = _path.replace(cls.SQL_FILE_PATH, '')
+    def reload_file(self, path: str) -> typing.Set[str]:
+        """
+        Reload one loaded file if its mtime or size changed, a file that fails to parse keeps its previous sql
+        :return: the changed sql_ids, the caller invalidates them
+        """
+        prefix, signature, sql_ids = GlobalData.sql_files[path]
+        try:
+            current = self.file_signature(path)
+        except OSError:
+            current = None
+        if current == signature:
+            return set()
+        changed = set()
+        if current is None:
+            del GlobalData.sql_files[path]
+            new_ids = []
+        else:
+            try:
+                sql_group = parse_sql_file(path)
+            except Exception:
+                logger.exception('Failed to reload sql file %s', path)
+                return set()
+            previous = {sql_id: GlobalData.sql_group.get(sql_id) for sql_id in sql_ids}
+            new_ids = self.index_sql_file(prefix, path, current, sql_group)
+            # Queries of the file that were not edited keep their cached templates
+            changed.update(sql_id for sql_id in new_ids if previous.get(sql_id) != GlobalData.sql_group[sql_id])
+        for sql_id in set(sql_ids) - set(new_ids):
+            GlobalData.sql_group.pop(sql_id, None)
+            changed.add(sql_id)
+        return changed
+
+    def reload_changed(self) -> typing.List[str]:
+        """
+        Reload only the loaded files whose mtime or size changed, and invalidate only the sql_ids whose sql changed.
+        Files that fail to parse (e.g. saved half way) keep their previous sql and are retried on the next call.
+        :return: the changed sql_ids
+        """
+        with self.reload_lock:
+            self.sql_data = SqlLoader.get_sql_data(self.SQL_FILE_PATH)  # New files are loaded on first use
+            changed = set()
+            for path in list(GlobalData.sql_files):
+                changed.update(self.reload_file(path))
+            if changed:
+                self.invalidate(changed)
+        return sorted(changed)
+
+    def start_watcher(self, interval: float = 2.0) -> threading.Thread:
+        """
+        Check the loaded files every interval seconds in a daemon thread and reload the changed ones.
+        Start it in every worker process, threads don't survive a fork.
+        """
+        if self.watcher and self.watcher.is_alive():
+            return self.watcher
+        stop = threading.Event()
+
+        def watch():
+            while not stop.wait(interval):
+                try:
+                    changed = self.reload_changed()
+                except Exception:
+                    logger.exception('Failed to reload sql files')
+                    continue
+                if changed:
+                    logger.info('Reloaded sql: %s', ', '.join(changed))
+
+        self.watcher = threading.Thread(target=watch, name='flask-sql-pro-watcher', daemon=True)
+        self.watcher.stop_event = stop
+        self.watcher.start()
+        return self.watcher
+
+    def stop_watcher(self):
+        if self.watcher:
+            self.watcher.stop_event.set()
+            self.watcher = None
 
-            if relative_path.startswith(os.sep):
-                relative_path = relative_path[1:]
-            if relative_path.endswith(os.sep):
-                relative_path = relative_path[:-1]
+    @classmethod
+    def preload_all_sqls(cls, workers: int = None, executor: str = None, cache_file: str = None):
+        """
+        Preload all sqls into memory
+        Files are parsed with the C yaml loader when available, in a thread or process pool.
+        With cache_file, parsed files are persisted by path, mtime and size so warm starts skip yaml parsing.
+        :param workers: pool size, 1 parses serially, 0 uses one worker per cpu, defaults to DB_HELPER_SQL_PRELOAD_WORKERS
+        :param executor: 'process' or 'thread', defaults to DB_HELPER_SQL_PRELOAD_EXECUTOR
+        :param cache_file: path of the parsed catalog cache, defaults to DB_HELPER_SQL_CACHE_FILE
+        """
+        workers = cls.preload_workers if workers is None else workers
+        executor = executor or cls.preload_executor
+        cache_file = cache_file or cls.catalog_cache_file
+        sql_data = cls.get_sql_data(cls.SQL_FILE_PATH)
+        if cache_file:
+            cache_path = os.path.abspath(cache_file)
+            sql_data = {prefix: path for prefix, path in sql_data.items() if os.path.abspath(path) != cache_path}
+
+        cached = cls.load_catalog_cache(cache_file) if cache_file else {}
+        catalog = {}
+        pending = []
+        for path in sql_data.values():
+            signature = cls.file_signature(path)
+            entry = cached.get(path)
+            if entry and tuple(entry[0]) == signature:
+                catalog[path] = (signature, entry[1])
+            else:
+                pending.append((path, signature))
 
-            prefix_sql_id = relative_path.replace(os.sep, '.')
+        parsed = cls.parse_sql_files([path for path, _ in pending], workers=workers, executor=executor)
+        for (path, signature), sql_group in zip(pending, parsed):
+            catalog[path] = (signature, sql_group)
+        if cache_file and (pending or len(cached) != len(catalog)):
+            cls.save_catalog_cache(cache_file, catalog)
 
-            for _f in files:
-                c_file = os.path.join(_path, _f)
-                c_file_name = _f.replace('.yml', '')
+        for prefix, path in sql_data.items():
+            signature, sql_group = catalog[path]
+            cls.index_sql_file(prefix, path, signature, sql_group)
+        return True
 
-                with open(c_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    sql_group = yaml.load(content, Loader=yaml.FullLoader)
-                    if not sql_group:
-                        continue
+    @staticmethod
+    def index_sql_file(prefix: str, path: str, signature: typing.Tuple[int, int], sql_group: typing.Dict) -> typing.List[str]:
+        """
+        Put every sql of a parsed file into GlobalData.sql_group and remember the file it came from
+        """
+        sql_ids = []
+        for _k, sql in sql_group.items():
+            sql_id = '%s.%s' % (prefix, _k)
+            GlobalData.sql_group[sql_id] = sql
+            sql_ids.append(sql_id)
+        GlobalData.sql_files[path] = (prefix, signature, sql_ids)
+        return sql_ids
 
-                    for _k in sql_group.keys():
-                        _sql_id = '%s.%s.%s' % (prefix_sql_id, c_file_name, _k)
-                        GlobalData.sql_group[_sql_id] = sql_group[_k]
+    @staticmethod
+    def file_signature(path: str) -> typing.Tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
 
-        return True
+    @staticmethod
+    def parse_sql_files(paths: typing.List[str], workers: int = None, executor: str = 'thread') -> typing.List[typing.Dict]:
+        """
+        Parse yml files in a pool, results are in the order of paths
+        """
+        if not paths:
+            return []
+        if workers == 1 or len(paths) == 1:
+            return [parse_sql_file(path) for path in paths]
+        workers = workers or None
+        if executor == 'process':
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(parse_sql_file, paths, chunksize=max(1, len(paths) // ((workers or os.cpu_count() or 1) * 4))))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(parse_sql_file, paths))
+
+    @classmethod
+    def load_catalog_cache(cls, cache_file: str) -> typing.Dict:
+        """
+        {path: ([mtime_ns, size], sql_group)}, empty when the file is missing, unreadable or of another format.
+        The cache is plain JSON, loading it never runs code whoever wrote the file.
+        """
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return {}
+        if not isinstance(data, dict) or data.get('version') != cls.catalog_cache_version:
+            return {}
+        files = data.get('files')
+        if not isinstance(files, dict):
+            return {}
+        # Entries that don't look like ([mtime_ns, size], sql_group) are re-parsed
+        return {path: entry for path, entry in files.items()
+                if isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], list) and isinstance(entry[1], dict)}
+
+    @classmethod
+    def save_catalog_cache(cls, cache_file: str, catalog: typing.Dict):
+        """
+        Write the cache atomically, concurrent workers never read a partial file.
+        A catalog holding values JSON can't represent (e.g. yaml dates) is not cached.
+        """
+        directory = os.path.dirname(os.path.abspath(cache_file))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.sql_catalog_')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': cls.catalog_cache_version, 'files': catalog}, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_file)
+        except TypeError:
+            os.remove(tmp_path)
+            logger.warning('The sql catalog holds values JSON can not store, %s is not written', cache_file)
+            return
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
     def get_sql(self, sql_id: str) -> str:
         if not hasattr(GlobalData, 'sql_group'):
             GlobalData.sql_group = {}
         if sql_id in GlobalData.sql_group:
-            return GlobalData.sql_group[sql_id]
+            sql = GlobalData.sql_group[sql_id]
         else:
             sql = self.__load_sql(sql_id)
             GlobalData.sql_group[sql_id] = sql
-            return sql
+        # An entry is either the sql itself or a mapping with the sql and its metadata
+        return sql['sql'] if isinstance(sql, dict) else sql
+
+    def get_sql_meta(self, sql_id: str) -> typing.Dict:
+        """
+        Metadata declared next to the sql, e.g.
+        select_dict:
+          sql: SELECT ...
+          tables: [sys_dict]
+          cache_ttl: 300
+        """
+        self.get_sql(sql_id)
+        entry = GlobalData.sql_group[sql_id]
+        return entry if isinstance(entry, dict) else {}
 
     def __load_sql(self, sql_id: str) -> str:
         # Find the file name and sql_id prefix based on the sql_id passed in
@@ -100,20 +360,25 @@ class SqlLoader(metaclass=SingletonType):
         c_file = self.sql_data.get(sql_id_prefix)
         if not c_file:
             raise Exception('sql file not found')
-        with open(c_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-            sql_group = yaml.load(content, Loader=yaml.FullLoader)
-            if not sql_group:
-                raise Exception('sql file is empty')
-            # Obtain sql based on sql_id
-            sql_keys = sql_id.split('.')
-            if len(sql_keys) > 1:
-                sql_key = sql_keys[-1]
-            else:
-                raise Exception('sql_id pattern error')
-            sql = sql_group.get(sql_key)
-            if not sql:
-                raise Exception('sql_id: %s not found' % sql_id)
+        with self.reload_lock:
+            if c_file not in GlobalData.sql_files:
+                # The file is parsed once and all of its sql_ids are indexed
+                signature = self.file_signature(c_file)
+                sql_group = parse_sql_file(c_file)
+                if not sql_group:
+                    raise Exception('sql file is empty')
+                self.index_sql_file(sql_id_prefix, c_file, signature, sql_group)
+            elif sql_id not in GlobalData.sql_group:
+                # The key may have been added to the file since it was loaded
+                changed = self.reload_file(c_file)
+                if changed:
+                    self.invalidate(changed)
+        # Obtain sql based on sql_id
+        if len(sql_id.split('.')) < 2:
+            raise Exception('sql_id pattern error')
+        sql = GlobalData.sql_group.get(sql_id)
+        if not sql:
+            raise Exception('sql_id: %s not found' % sql_id)
         return sql
 
     @staticmethod
@@ -137,7 +402,46 @@ class SqlLoader(metaclass=SingletonType):
             for file in file_list
         }
 
-    def preload_sql(self, sql_id: str, options: typing.Dict = None) -> str:
+    def get_template(self, sql_id: str, mode: str = None) -> jinja2.Template:
+        """
+        Get the compiled template of sql_id, compiling it only on the first call
+        :param sql_id: id of the sql query
+        :param mode: key of sql_wrappers wrapped around the sql, e.g. 'page' appends the LIMIT/OFFSET block
+        :return:
+        """
+        key = (sql_id, mode)
+        template = self.template_cache.get(key)
+        if template is None:
+            generation = self.generation
+            c_sql = self.get_sql(sql_id)
+            if mode:
+                prefix, suffix = self.sql_wrappers[mode]
+                if mode == 'keyset' and self.keyset_inner_pattern.search(c_sql):
+                    logger.warning(
+                        'Keyset paging of %s wraps an sql with ORDER BY/LIMIT in a derived table, '
+                        'place {{ keyset_where }} and {{ keyset_order }} in the sql instead', sql_id,
+                    )
+                c_sql = prefix + self.strip_statement_end(c_sql) + suffix
+            template = self.template_env.from_string(c_sql)
+            with self.reload_lock:
+                if generation == self.generation:
+                    self.template_cache.set(key, template)
+        return template
+
+    @classmethod
+    def strip_statement_end(cls, sql: str) -> str:
+        """
+        Remove the trailing ';' and whole-line comments of the sql, the wrappers start their suffix
+        on a new line so a comment after the last clause does not swallow it
+        """
+        lines = sql.rstrip().split('\n')
+        while lines and (not lines[-1].strip() or lines[-1].lstrip().startswith('--')):
+            lines.pop()
+        if lines:
+            lines[-1] = cls.statement_end_pattern.sub('', lines[-1].rstrip())
+        return '\n'.join(lines)
+
+    def preload_sql(self, sql_id: str, options: typing.Dict = None, limit_one: bool = False, count: bool = False) -> str:
         """
         Preloaded sql
 
@@ -146,15 +450,27 @@ class SqlLoader(metaclass=SingletonType):
         "page": 1,
         "page_size": 20,
         }
+        Keyset paging: Select page_size rows after the cursor ordered by the keyset column,
+        the value of the cursor is bound from the :_keyset_cursor parameter.
+        The sql is wrapped in a derived table filtered by the cursor, unless it places the
+        {{ keyset_where }} predicate and the {{ keyset_order }} clause itself, e.g.
+        SELECT id, name FROM user WHERE age > :age AND {{ keyset_where }} ORDER BY {{ keyset_order }}
+        {
+        "keyset": "id",
+        "cursor": True,  # False or missing on the first page
+        "order": "desc",  # Optional, defaults to asc
+        "page_size": 20,
+        }
         :param sql_id: id of the sql query
         :param options: Dynamically add parameter dictionary
+        :param limit_one: append LIMIT 1 instead of paging
+        :param count: wrap the sql in SELECT COUNT(*), paging options are ignored
         :return:
         """
-        if not options:
-            options = {}
+        if not options and not limit_one and not count:
+            return self.get_sql(sql_id)
+        options = dict(options or {})  # Rendered results are cached by the caller's options, leave them untouched
 
-        c_sql = self.get_sql(sql_id)
-        
         page_num = options.get(self.page_param)
         page_size = options.get(self.page_size_param)
 
@@ -163,21 +479,34 @@ class SqlLoader(metaclass=SingletonType):
         if page_size:
             del options[self.page_size_param]
 
-        if any([page_num, page_size]):
+        mode = None
+        if count:
+            mode = 'count'
+        elif limit_one:
+            mode = 'one'
+        elif options.get(self.keyset_param):
+            mode = 'keyset'
+            keyset_key = options.pop(self.keyset_param)
+            if not self.keyset_key_pattern.match(keyset_key):
+                raise ValueError('Invalid keyset column: %s' % keyset_key)
+            options['_keyset_key'] = keyset_key
+            options['_keyset_cursor'] = bool(options.pop(self.keyset_cursor_param, None))
+            options['_keyset_desc'] = str(options.pop(self.keyset_order_param, 'asc')).lower() == 'desc'
+            options['_keyset_limit'] = int(page_size if page_size else 10)
+            if self.keyset_hook_pattern.search(self.get_sql(sql_id)):
+                mode = 'keyset_inline'
+                options['keyset_where'] = '%s %s :_keyset_cursor' % (
+                    keyset_key, '<' if options['_keyset_desc'] else '>') if options['_keyset_cursor'] else '1=1'
+                options['keyset_order'] = '%s %s' % (keyset_key, 'DESC' if options['_keyset_desc'] else 'ASC')
+        elif any([page_num, page_size]):
+            mode = 'page'
             page_num = page_num if page_num else 1
             options['limit'] = int(page_size if page_size else 10)
             options['offset'] = int((page_num - 1) * options['limit'])
 
-            c_sql += """
-            {% if limit and not offset %}
-                LIMIT {{ limit }}
-                {% elif limit and offset %}
-                LIMIT {{ offset }},{{ limit }}
-            {% endif %}
-            """
-
-        return jinja2.Template(c_sql).render(options) if options else c_sql
-
+        if not options and not mode:
+            return self.get_sql(sql_id)
+        return self.get_template(sql_id, mode).render(options)
 
 if __name__ == '__main__':
     sql_loader = SqlLoader()
@@ -16,6 +16,9 @@ setup(
         'flask_sqlalchemy',
         'pyyaml',
     ],
+    extras_require={
+        'async': ['SQLAlchemy>=1.4', 'aiosqlite'],
+    },
     classifiers=[
         'Programming Language :: Python',
         'Programming Language :: Python :: 3.7',
@@ -0,0 +1,50 @@
+"""
+Shared fixtures: a Flask app on SQLite files with the sql catalog of tests/sql
+"""
+import os
+
+import pytest
+from flask import Flask
+
+from flask_sql_pro import DataBaseHelper, FlaskSQLPro
+
+SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql')
+USER_TABLE = (
+    'CREATE TABLE user ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, name VARCHAR(64) UNIQUE, age INTEGER, delete_flag INTEGER DEFAULT 0)'
+)
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """
+    Build an app on tmp_path/main.db with the user table, every bind gets its own file and user table
+    """
+    contexts = []
+
+    def make(binds=(), **config):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'main.db')
+        app.config['SQLALCHEMY_BINDS'] = {bind: 'sqlite:///' + str(tmp_path / (bind + '.db')) for bind in binds}
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        app.config['DB_HELPER_SQL_FILE_PATH'] = SQL_PATH
+        app.config.update(config)
+        db = FlaskSQLPro().init_app(app)
+        context = app.app_context()
+        context.push()
+        contexts.append(context)
+        for bind in (None,) + tuple(binds):
+            db.get_engine(app, bind=bind).execute(USER_TABLE)
+        return app, db
+
+    yield make
+    for context in reversed(contexts):
+        DataBaseHelper.db.session.remove()
+        context.pop()
+    # Cached clauses, totals and results outlive the databases of the test
+    DataBaseHelper.invalidate_sqls()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()[0]
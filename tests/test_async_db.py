@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('sqlalchemy.ext.asyncio')
+pytest.importorskip('aiosqlite')
+
+from flask_sql_pro.async_db import AsyncDataBaseHelper  # noqa: E402
+
+
+@pytest.fixture
+def helper(make_app, tmp_path):
+    make_app(DB_HELPER_ASYNC_DATABASE_URI='sqlite+aiosqlite:///' + str(tmp_path / 'main.db'))
+    return AsyncDataBaseHelper
+
+
+def run(helper, coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await helper.close()
+            await helper.dispose()
+    return asyncio.run(main())
+
+
+def test_create_select_page_and_trans(helper):
+    async def scenario():
+        for age in range(5):
+            assert await helper.execute_create('user', {'name': 'user_%d' % age, 'age': age}, commit=True)
+
+        rows = await helper.select_all('demo.user.select_all', {'min_age': 3}, {'min_age': 3})
+        assert [row.name for row in rows] == ['user_3', 'user_4']
+        assert (await helper.select_one('demo.user.select_ids', limit=True)).name == 'user_0'
+
+        page = await helper.select_page('demo.user.select_ids', options={'page': 2, 'page_size': 2})
+        assert [row.age for row in page.rows] == [2, 3]
+        assert page.total == 5
+
+        rows, cursor = await helper.select_keyset('demo.user.select_ids', options={'keyset': 'id', 'page_size': 3})
+        assert [row.id for row in rows] == [1, 2, 3]
+        rows, cursor = await helper.select_keyset('demo.user.select_ids', options={'keyset': 'id', 'page_size': 3}, cursor=cursor)
+        assert [row.id for row in rows] == [4, 5] and cursor is None
+
+        with pytest.raises(RuntimeError):
+            async with helper.trans():
+                await helper.execute_update('user', {'age': 10}, {'name': 'user_0'})
+                raise RuntimeError
+        assert await helper.select_scalar('demo.user.select_ids') == 1
+        assert (await helper.select_one('demo.user.select_ids')).age == 0
+
+        async with helper.trans():
+            assert await helper.execute_delete('user', {'name': 'user_0'}) == 1
+        assert await helper.select_count('demo.user.select_ids', use_cache=False) == 4
+
+    run(helper, scenario())
+
+
+def test_every_event_loop_has_its_own_engine(helper):
+    # Pooled connections of a previous loop can't be used by the next asyncio.run
+    for _ in range(2):
+        assert run(helper, helper.select_all('demo.user.select_ids')) == []
+
+
+def test_sync_only_helpers_are_not_inherited(helper):
+    assert not hasattr(helper, 'select_in')
+    assert not hasattr(helper, 'execute_create_many')
@@ -0,0 +1,67 @@
+from sqlalchemy import text
+
+from flask_sql_pro import DataBaseHelper
+from flask_sql_pro.cache import LRUCache, ResultCache, make_key
+
+
+def test_rendered_clauses_are_reused(app):
+    clause = DataBaseHelper.get_clause('demo.user.select_all', options={'min_age': 1})
+    assert DataBaseHelper.get_clause('demo.user.select_all', options={'min_age': 1}) is clause
+    assert DataBaseHelper.get_clause('demo.user.select_all', options={'min_age': 0}) is not clause
+    # Unhashable options are rendered on every call
+    options = {'min_age': 1, 'data': bytearray(b'a')}
+    assert DataBaseHelper.get_clause('demo.user.select_all', options=options) is not \
+        DataBaseHelper.get_clause('demo.user.select_all', options=options)
+
+
+def test_cache_keys_tell_equal_scalars_of_different_types_apart():
+    assert make_key({'flag': 1}) != make_key({'flag': True})
+    assert make_key({'flag': 1}) != make_key({'flag': 1.0})
+    assert make_key({'ids': [1, 2]}) == make_key({'ids': [1, 2]})
+    assert make_key({'ids': [1, 2]}) != make_key({'ids': (1, 2)})
+    assert make_key({'data': bytearray(b'a')}) is None
+
+
+def test_write_statements_are_reused_per_shape(app):
+    sql, data = DataBaseHelper.build_update('user', {'age': 1}, {'id': 1})
+    again, data_again = DataBaseHelper.build_update('user', {'age': 2}, {'id': 2})
+    assert again is sql and data_again != data
+    assert DataBaseHelper.build_update('user', {'age': 1}, {'id__in': [1, 2]})[0] is not sql
+    assert DataBaseHelper.build_delete('user', {'id': 1})[0] is DataBaseHelper.build_delete('user', {'id': 5})[0]
+    # Statements of equal shape write the values they are given
+    assert DataBaseHelper.execute_create('user', {'name': 'a', 'age': 1}, commit=True) == 1
+    assert DataBaseHelper.execute_create('user', {'name': 'b', 'age': 2}, commit=True) == 2
+    assert DataBaseHelper.execute_update('user', {'age': 5}, {'id': 2}, commit=True) == 1
+    assert [row.age for row in DataBaseHelper.select_all('demo.user.select_ids')] == [1, 5]
+
+
+def cached_names():
+    return [row.name for row in DataBaseHelper.select_all('demo.user.cached_names')]
+
+
+def test_result_cache_is_invalidated_by_writes(make_app):
+    _, db = make_app(DB_HELPER_RESULT_CACHE=True)
+    DataBaseHelper.execute_create('user', {'name': 'a', 'age': 1}, commit=True)
+    assert cached_names() == ['a']
+    # Writes bypassing the helper are not seen until the ttl ends
+    db.session.execute(text("INSERT INTO user (name, age) VALUES ('b', 2)"))
+    db.session.commit()
+    assert cached_names() == ['a']
+
+    DataBaseHelper.execute_update('user', {'age': 3}, {'name': 'a'})
+    # Tables written in the open transaction are read from the database
+    assert cached_names() == ['a', 'b']
+    DataBaseHelper.execute_create('user', {'name': 'c', 'age': 3})
+    assert cached_names() == ['a', 'b', 'c']
+    DataBaseHelper.rollback()
+    assert cached_names() == ['a', 'b']
+
+
+def test_result_cache_versions_are_shared_through_the_backend():
+    backend = LRUCache(16)
+    first, second = ResultCache(backend), ResultCache(backend)
+    key = first.tag(('demo.user.cached_names', (), (), None), ['user'])
+    first.set(key, 'rows')
+    assert second.get(second.tag(key[0], ['user'])) == 'rows'
+    second.invalidate('user')
+    assert first.get(first.tag(key[0], ['user'])) is None
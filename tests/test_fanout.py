@@ -0,0 +1,35 @@
+import pytest
+
+from flask_sql_pro import DataBaseHelper, FanoutError
+
+
+@pytest.fixture
+def shards(make_app):
+    app, db = make_app(binds=('s1', 's2'))
+    for bind, names in (('s1', ['a', 'c']), ('s2', ['b', 'd'])):
+        for name in names:
+            db.get_engine(app, bind=bind).execute("INSERT INTO user (name, age) VALUES ('%s', 1)" % name)
+    return app, db
+
+
+def test_select_all_across_merges_the_binds(shards):
+    app, _ = shards
+    rows = DataBaseHelper.select_all_across('demo.user.select_ids', binds=['s1', 's2'], app=app)
+    assert [row.name for row in rows] == ['a', 'c', 'b', 'd']
+    rows = DataBaseHelper.select_all_across('demo.user.select_names', binds=['s1', 's2'], app=app, merge='ordered', order_by='name')
+    assert [row.name for row in rows] == ['a', 'b', 'c', 'd']
+    results = DataBaseHelper.select_all_across('demo.user.select_ids', binds=['s1', 's2'], app=app, merge='dict')
+    assert [row.name for row in results['s2']] == ['b', 'd']
+
+
+def test_select_all_across_reports_failed_binds(shards):
+    app, db = shards
+    db.get_engine(app, bind='s2').execute('DROP TABLE user')
+    with pytest.raises(FanoutError) as info:
+        DataBaseHelper.select_all_across('demo.user.select_ids', binds=['s1', 's2'], app=app)
+    assert list(info.value.errors) == ['s2']
+    assert [row.name for row in info.value.results['s1']] == ['a', 'c']
+
+    rows, errors = DataBaseHelper.select_all_across('demo.user.select_ids', binds=['s1', 's2'], app=app, raise_errors=False)
+    assert [row.name for row in rows] == ['a', 'c']
+    assert list(errors) == ['s2']
@@ -0,0 +1,103 @@
+import json
+import os
+
+import pytest
+
+from flask_sql_pro import DataBaseHelper
+from flask_sql_pro.sql_loader import GlobalData, Loader, SqlLoader
+
+from conftest import SQL_PATH
+
+USER_FILE = os.path.join(SQL_PATH, 'demo', 'user.yml')
+
+
+@pytest.fixture
+def loaded(app):
+    Loader.loader.reload()
+    yield Loader.loader
+    Loader.loader.reload()
+
+
+def test_templates_are_compiled_once(loaded):
+    first = loaded.preload_sql('demo.user.select_all', options={'min_age': 1})
+    template = loaded.get_template('demo.user.select_all')
+    assert loaded.preload_sql('demo.user.select_all', options={'min_age': 1}) == first
+    assert 'AND age >= :min_age' in first
+    assert 'AND age' not in loaded.preload_sql('demo.user.select_all', options={'min_age': 0})
+    assert loaded.get_template('demo.user.select_all') is template
+    # Options given by the caller are left untouched
+    options = {'page': 2, 'page_size': 3}
+    assert 'LIMIT' in loaded.preload_sql('demo.user.select_ids', options=options).upper()
+    assert options == {'page': 2, 'page_size': 3}
+
+
+def test_catalog_cache_is_json(loaded, tmp_path):
+    cache_file = str(tmp_path / 'sql_catalog.json')
+    SqlLoader.preload_all_sqls(workers=1, cache_file=cache_file)
+    expected = dict(GlobalData.sql_group)
+    with open(cache_file, encoding='utf-8') as f:
+        assert json.load(f)['version'] == SqlLoader.catalog_cache_version
+
+    GlobalData.sql_group = {}
+    GlobalData.sql_files = {}
+    SqlLoader.preload_all_sqls(workers=1, cache_file=cache_file)
+    assert GlobalData.sql_group == expected
+    # The signature read from the cache still matches the file, so a reload check is a no-op
+    assert GlobalData.sql_files[USER_FILE][1] == SqlLoader.file_signature(USER_FILE)
+    assert SqlLoader().reload_changed() == []
+
+
+@pytest.mark.parametrize('content', [b'\x80\x04K\x01.', b'[]', b'{"version": 2, "files": {"x": 1}}'])
+def test_unusable_catalog_cache_is_ignored(loaded, tmp_path, content):
+    cache_file = tmp_path / 'sql_catalog.json'
+    cache_file.write_bytes(content)
+    SqlLoader.preload_all_sqls(workers=1, cache_file=str(cache_file))
+    assert 'demo.user.select_ids' in GlobalData.sql_group
+    with open(str(cache_file), encoding='utf-8') as f:
+        assert USER_FILE in json.load(f)['files']
+
+
+def write_sql(path, content):
+    path.write_text(content, encoding='utf-8')
+    # The signature is (mtime_ns, size), move the mtime for edits of the same size
+    stat = os.stat(str(path))
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+
+@pytest.fixture
+def items(make_app, tmp_path):
+    """
+    sql/reload/items.yml in tmp_path, loaded by a fresh catalog
+    """
+    items = tmp_path / 'sql' / 'reload' / 'items.yml'
+    items.parent.mkdir(parents=True)
+    write_sql(items, 'first: SELECT 1 AS v\nsecond: SELECT 2 AS v\n')
+    make_app(DB_HELPER_SQL_FILE_PATH=str(tmp_path / 'sql'))
+    Loader.loader.reload()
+    yield items
+    # SqlLoader is a singleton, the apps of the next tests must not see the files of this one
+    SqlLoader.SQL_FILE_PATH = SQL_PATH
+    Loader.loader.reload()
+
+
+def test_changed_files_are_reloaded_incrementally(items):
+    loader = Loader.loader
+    assert DataBaseHelper.select_scalar('reload.items.first') == 1
+    second = DataBaseHelper.get_clause('reload.items.second', options={'x': 1})
+
+    # A key added to a loaded file is found without a reload
+    write_sql(items, 'first: SELECT 1 AS v\nsecond: SELECT 2 AS v\nthird: SELECT 3 AS v\n')
+    assert DataBaseHelper.select_scalar('reload.items.third') == 3
+
+    write_sql(items, 'first: SELECT 10 AS v\nsecond: SELECT 2 AS v\n')
+    assert loader.reload_changed() == ['reload.items.first', 'reload.items.third']
+    assert DataBaseHelper.select_scalar('reload.items.first') == 10
+    # Unchanged sql keeps its cached clause
+    assert DataBaseHelper.get_clause('reload.items.second', options={'x': 1}) is second
+    with pytest.raises(Exception, match='not found'):
+        loader.get_sql('reload.items.third')
+
+    # A file saved half way keeps its previous sql
+    write_sql(items, 'first: [SELECT\n')
+    assert loader.reload_changed() == []
+    assert DataBaseHelper.select_scalar('reload.items.first') == 10
@@ -0,0 +1,37 @@
+import logging
+
+from flask_sql_pro import DataBaseHelper
+from flask_sql_pro.metrics import Histogram
+
+
+def test_executions_are_measured_per_sql_id_and_table(make_app, caplog):
+    events = []
+    make_app(DB_HELPER_METRICS=True, DB_HELPER_SLOW_QUERY_THRESHOLD=0, DB_HELPER_METRICS_HOOKS=[events.append])
+    DataBaseHelper.execute_create_many('user', [{'name': 'a', 'age': 1}, {'name': 'b', 'age': 2}], commit=True)
+    with caplog.at_level(logging.WARNING, logger='flask_sql_pro.metrics'):
+        DataBaseHelper.select_all('demo.user.select_ids')
+        DataBaseHelper.select_all('demo.user.select_ids')
+    DataBaseHelper.select_all('demo.user.by_ids', {'ids': 1})
+
+    stats = DataBaseHelper.metrics.get('sql', 'demo.user.select_ids')
+    assert (stats['calls'], stats['errors'], stats['rows']) == (2, 0, 4)
+    assert set(stats['latency']) == {'render', 'execute', 'fetch', 'total'}
+    assert DataBaseHelper.metrics.get('sql', 'demo.user.by_ids')['errors'] == 1
+    assert DataBaseHelper.metrics.snapshot()['table']['user']['rows'] == 2
+    assert 'Slow sql <demo.user.select_ids>' in caplog.text
+    assert [event['name'] for event in events] == ['user', 'demo.user.select_ids', 'demo.user.select_ids', 'demo.user.by_ids']
+
+
+def test_nothing_is_measured_while_disabled(app):
+    assert DataBaseHelper.metrics.timer('sql', 'demo.user.select_ids') is None
+    DataBaseHelper.select_all('demo.user.select_ids')
+    assert DataBaseHelper.metrics.snapshot() == {}
+
+
+def test_histogram_percentiles():
+    histogram = Histogram(buckets=(1, 2, 3))
+    for value in (0.5, 1.5, 1.5, 2.5, 10):
+        histogram.observe(value)
+    assert (histogram.percentile(0.2), histogram.percentile(0.5), histogram.percentile(0.8)) == (1, 2, 3)
+    assert histogram.percentile(1) == 10
+    assert Histogram().percentile(0.5) is None
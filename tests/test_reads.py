@@ -0,0 +1,109 @@
+import io
+import json
+import pickle
+
+import pytest
+
+from flask_sql_pro import DataBaseHelper, DBRow
+
+
+@pytest.fixture
+def users(app):
+    DataBaseHelper.execute_create_many('user', [{'name': 'user_%d' % i, 'age': i} for i in range(10)], commit=True)
+    return app
+
+
+def test_select_in_expands_and_chunks_the_list(users, monkeypatch):
+    rows = DataBaseHelper.select_in('demo.user.by_ids', 'ids', [2, 4])
+    assert [row.id for row in rows] == [2, 4]
+
+    executions = []
+    monkeypatch.setitem(DataBaseHelper.in_chunk_sizes, 'sqlite', 2)
+    monkeypatch.setattr(DataBaseHelper, 'execute_read', classmethod(
+        lambda cls, clause, params=None, app=None, primary=False, _original=DataBaseHelper.execute_read:
+        executions.append(params['ids']) or _original(clause, params, app=app, primary=primary)
+    ))
+    rows = DataBaseHelper.select_in('demo.user.by_ids', 'ids', [1, 3, 3, 5, 7])
+    assert [row.id for row in rows] == [1, 3, 5, 7]
+    assert executions == [[1, 3], [5, 7]]
+
+
+def test_streaming_helpers(users):
+    rows = list(DataBaseHelper.select_iter('demo.user.select_ids', chunk_size=3, return_obj='row'))
+    assert [row.id for row in rows] == list(range(1, 11))
+
+    columns = DataBaseHelper.select_columns('demo.user.select_ids', chunk_size=4)
+    assert list(columns.age) == list(range(10))
+    assert columns.name[:2] == ['user_0', 'user_1']
+
+    out = io.StringIO()
+    assert DataBaseHelper.export_sql('demo.user.select_ids', fmt='csv', out=out, chunk_size=4) == 10
+    lines = out.getvalue().splitlines()
+    assert lines[0] == 'id,name,age' and lines[1] == '1,user_0,0' and len(lines) == 11
+
+    lines = ''.join(DataBaseHelper.export_sql('demo.user.select_ids', fmt='jsonl')).splitlines()
+    assert json.loads(lines[-1]) == {'id': 10, 'name': 'user_9', 'age': 9}
+
+
+def test_streaming_helpers_on_a_failing_sql(users):
+    params = {'min_age': 1}
+    assert list(DataBaseHelper.select_iter('demo.user.by_ids', params)) == []
+    assert DataBaseHelper.select_columns('demo.user.by_ids', params) == {}
+    assert list(DataBaseHelper.export_sql('demo.user.by_ids', params)) == []
+
+
+def test_compact_rows(users):
+    rows = DataBaseHelper.select_all('demo.user.select_ids', return_obj='row')
+    row = rows[1]
+    assert isinstance(row, DBRow)
+    assert (row.id, row['name'], row.get('age'), row.missing) == (2, 'user_1', 1, None)
+    assert row == {'id': 2, 'name': 'user_1', 'age': 1} and row.to_dict().name == 'user_1'
+    assert list(row) == ['id', 'name', 'age'] and 'age' in row
+    assert pickle.loads(pickle.dumps(row)) == row
+    # Every row of a result shares the key map
+    assert row._keymap is rows[0]._keymap
+
+
+def test_select_one_and_select_scalar(users):
+    assert DataBaseHelper.select_one('demo.user.select_ids') == {'id': 1, 'name': 'user_0', 'age': 0}
+    assert DataBaseHelper.select_one('demo.user.select_all', {'min_age': 8}, {'min_age': 8}, limit=True).name == 'user_8'
+    assert isinstance(DataBaseHelper.select_one('demo.user.select_names', return_obj='row'), DBRow)
+    assert DataBaseHelper.select_one('demo.user.select_all', {'min_age': 100}, {'min_age': 100}) == {}
+
+    assert DataBaseHelper.select_scalar('demo.user.select_names', limit=True) == 1
+    assert DataBaseHelper.select_scalar('demo.user.select_all', {'min_age': 100}, {'min_age': 100}, default=0) == 0
+
+
+@pytest.mark.parametrize('sql_id, params', [('demo.user.select_names', None), ('demo.user.keyset_adults', {'min_age': 0})])
+def test_keyset_pages(users, sql_id, params):
+    pages, cursor = [], None
+    while True:
+        rows, cursor = DataBaseHelper.select_keyset(sql_id, params, {'keyset': 'id', 'page_size': 4}, cursor=cursor)
+        pages.append([row.id for row in rows])
+        if cursor is None:
+            break
+    assert pages == [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]]
+
+    rows, cursor = DataBaseHelper.select_keyset(sql_id, params, {'keyset': 'id', 'order': 'desc', 'page_size': 3}, last_value=5)
+    assert [row.id for row in rows] == [4, 3, 2]
+    assert DataBaseHelper.decode_cursor(cursor) == 2
+
+
+def test_keyset_requires_a_valid_column(users):
+    with pytest.raises(ValueError):
+        DataBaseHelper.select_keyset('demo.user.select_ids', options={'page_size': 4})
+    with pytest.raises(ValueError):
+        DataBaseHelper.select_keyset('demo.user.select_ids', options={'keyset': 'id; DROP TABLE user'})
+
+
+def test_select_page_counts_once_per_result(users):
+    page = DataBaseHelper.select_page('demo.user.select_all', {'min_age': 2}, {'min_age': 2, 'page': 2, 'page_size': 3})
+    assert [row.age for row in page.rows] == [5, 6, 7]
+    assert (page.total, page.page, page.page_size) == (8, 2, 3)
+
+    # The total is cached per params and options, whatever the page
+    DataBaseHelper.execute_create('user', {'name': 'user_10', 'age': 10}, commit=True)
+    page = DataBaseHelper.select_page('demo.user.select_all', {'min_age': 2}, {'min_age': 2, 'page': 3, 'page_size': 3})
+    assert [row.age for row in page.rows] == [8, 9, 10] and page.total == 8
+    assert DataBaseHelper.select_page('demo.user.select_all', {'min_age': 2}, {'min_age': 2}, use_cache=False).total == 9
+    assert DataBaseHelper.select_count('demo.user.select_ids', use_cache=False) == 11
@@ -0,0 +1,50 @@
+import pytest
+
+from flask_sql_pro import DataBaseHelper
+
+
+def names():
+    return [row.name for row in DataBaseHelper.select_all('demo.user.select_ids')]
+
+
+@pytest.fixture
+def replicated(make_app):
+    """
+    The primary holds the user 'primary', the replica the user 'replica', so every read tells where it went
+    """
+    app, db = make_app(binds=('replica',), DB_HELPER_READ_REPLICAS=['replica'])
+    db.get_engine(app).execute("INSERT INTO user (name, age) VALUES ('primary', 1)")
+    db.get_engine(app, bind='replica').execute("INSERT INTO user (name, age) VALUES ('replica', 1)")
+    return app, db
+
+
+def test_reads_go_to_the_replica_until_a_write(replicated):
+    assert names() == ['replica']
+    assert DataBaseHelper.select_one('demo.user.select_ids').name == 'replica'
+    with DataBaseHelper.db.trans():
+        assert names() == ['primary']
+    assert names() == ['replica']
+
+    DataBaseHelper.execute_create('user', {'name': 'b', 'age': 2}, commit=True)
+    # Replicas may lag behind the write, the session keeps reading from the primary
+    assert names() == ['primary', 'b']
+    # Until the end of the request
+    DataBaseHelper.db.session.remove()
+    assert names() == ['replica']
+
+
+def test_explicit_binds_are_honoured(replicated):
+    app, _ = replicated
+    assert [row.name for row in DataBaseHelper.select_all('demo.user.select_ids', app=app, bind='replica')] == ['replica']
+    DataBaseHelper.execute_create('user', {'name': 'b', 'age': 2}, app=app, bind='replica', commit=True)
+    assert DataBaseHelper.select_count('demo.user.select_ids', app=app, bind='replica', use_cache=False) == 2
+
+
+def test_failing_replica_falls_back_to_the_primary(replicated):
+    app, db = replicated
+    db.get_engine(app, bind='replica').execute('DROP TABLE user')
+    assert names() == ['primary']
+    # The replica is skipped for DB_HELPER_REPLICA_RETRY_AFTER seconds
+    assert DataBaseHelper.choose_replica() is None
+    DataBaseHelper.replica_down_until.clear()
+    assert DataBaseHelper.choose_replica() == 'replica'
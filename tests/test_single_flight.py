@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from flask_sql_pro import DataBaseHelper
+from flask_sql_pro.cache import SingleFlight
+
+
+def run_concurrently(single_flight, leader_func, follower_func, followers=3):
+    """
+    Call do('key') with leader_func, then with follower_func from other threads while the leader is running
+    """
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def leader():
+        started.set()
+        release.wait(5)
+        return leader_func()
+
+    def call(func):
+        try:
+            results.append(single_flight.do('key', func))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call, args=(leader,))]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=call, args=(follower_func,)) for _ in range(followers)]
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.2)  # Let the followers block on the leader
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_calls_share_one_execution():
+    single_flight = SingleFlight()
+    results = run_concurrently(single_flight, lambda: 'leader', lambda: 'follower')
+    assert sorted(results) == [('leader', False)] + [('leader', True)] * 3
+    assert single_flight.stats() == {'executions': 1, 'collapsed': 3, 'timeouts': 0, 'in_flight': 0}
+
+
+def test_followers_run_the_call_themselves_when_the_leader_fails_or_times_out():
+    def fail():
+        raise RuntimeError('leader failed')
+
+    results = run_concurrently(SingleFlight(), fail, lambda: 'follower', followers=2)
+    assert sorted(map(repr, results)) == sorted([repr(RuntimeError('leader failed'))] + [repr(('follower', False))] * 2)
+
+    single_flight = SingleFlight(timeout=0.01)
+    results = run_concurrently(single_flight, lambda: 'leader', lambda: 'follower', followers=2)
+    assert sorted(results) == [('follower', False)] * 2 + [('leader', False)]
+    assert single_flight.stats()['timeouts'] == 2
+
+
+def test_shared_results_are_never_aliased(make_app, monkeypatch):
+    make_app(DB_HELPER_SINGLE_FLIGHT=True)
+    DataBaseHelper.execute_create('user', {'name': 'a', 'age': 1}, commit=True)
+    DataBaseHelper.db.session.remove()
+    # Both calls get the rows fetched by another caller
+    shared = DataBaseHelper.fetch_rows('demo.user.select_ids')
+    monkeypatch.setattr(DataBaseHelper.single_flight, 'do', lambda key, func: (shared, True))
+    first, second = DataBaseHelper.select_all('demo.user.select_ids'), DataBaseHelper.select_all('demo.user.select_ids')
+    assert first == second == [{'id': 1, 'name': 'a', 'age': 1}]
+    assert first[0] is not second[0]
+
+
+@pytest.mark.parametrize('config', [{}, {'DB_HELPER_SINGLE_FLIGHT': True}])
+def test_calls_run_on_their_own_when_they_must_see_the_session(make_app, config):
+    make_app(**config)
+    key = DataBaseHelper.single_flight_key('demo.user.select_ids', None, None, None)
+    assert (key is not None) == bool(config)
+    with DataBaseHelper.db.trans():
+        assert DataBaseHelper.single_flight_key('demo.user.select_ids', None, None, None) is None
+    DataBaseHelper.execute_create('user', {'name': 'a', 'age': 1}, commit=True)
+    assert DataBaseHelper.single_flight_key('demo.user.select_ids', None, None, None) is None
+    DataBaseHelper.db.session.remove()
+    assert DataBaseHelper.single_flight_key('demo.user.select_ids', {'ids': bytearray(b'1')}, None, None) is None
@@ -0,0 +1,29 @@
+import pytest
+
+from flask_sql_pro import DataBaseHelper
+
+
+@pytest.mark.parametrize('name', ['user', 'db.user', '`user`', '`db`.`user`', '`user#`', 'name__in'])
+def test_valid_identifiers(name):
+    assert DataBaseHelper.validate_identifier(name) == name
+
+
+@pytest.mark.parametrize('name', ['user#', 'user -- x', 'user;', '`user', 'user`', '1user', 'user where 1=1'])
+def test_invalid_identifiers(name):
+    with pytest.raises(ValueError):
+        DataBaseHelper.validate_identifier(name)
+
+
+def test_unquoted_sharp_can_not_comment_out_the_where_phrase(app):
+    DataBaseHelper.execute_create('user', {'name': 'a', 'age': 1}, commit=True)
+    with pytest.raises(ValueError):
+        DataBaseHelper.execute_delete('user#', {'id': 2}, commit=True)
+    assert DataBaseHelper.select_scalar('demo.user.select_ids') == 1
+
+
+def test_writes_validate_columns_on_the_default_bind(make_app):
+    make_app(DB_HELPER_VALIDATE_COLUMNS=True)
+    assert DataBaseHelper.execute_create('user', {'name': 'a', 'age': 1}, commit=True) == 1
+    assert DataBaseHelper.execute_update('user', {'age': 2}, {'NAME': 'a'}, commit=True) == 1
+    with pytest.raises(ValueError, match='Unknown column'):
+        DataBaseHelper.execute_create('user', {'name': 'b', 'score': 1})
@@ -0,0 +1,103 @@
+import pytest
+from sqlalchemy.dialects import mysql
+from sqlalchemy.exc import IntegrityError
+
+from flask_sql_pro import DataBaseHelper
+
+
+def select_names():
+    return [row.name for row in DataBaseHelper.select_all('demo.user.select_ids')]
+
+
+def test_execute_create_many_returns_ids(app):
+    count, ids = DataBaseHelper.execute_create_many(
+        'user', [{'name': 'user_%d' % i, 'age': i} for i in range(5)], return_ids=True, commit=True,
+    )
+    assert count == 5
+    assert ids == [1, 2, 3, 4, 5]
+
+
+def test_returning_rows_per_statement_are_capped_by_the_param_limit(app, monkeypatch):
+    statements = []
+    monkeypatch.setattr(DataBaseHelper, 'get_param_limit', classmethod(lambda cls, dialect: 10))
+    monkeypatch.setattr(DataBaseHelper, 'get_insert_sql', classmethod(
+        lambda cls, tb_name, keys, rows=1, _original=DataBaseHelper.get_insert_sql: statements.append(rows) or _original(tb_name, keys, rows=rows)
+    ))
+    count, ids = DataBaseHelper.execute_create_many(
+        'user', [{'name': 'user_%d' % i, 'age': i} for i in range(12)], return_ids=True, commit=True,
+    )
+    # 2 columns per row and 10 params per statement
+    assert statements == [5, 5, 2]
+    assert count == 12 and ids == list(range(1, 13))
+
+
+def test_update_and_delete_with_in_lists(app, monkeypatch):
+    DataBaseHelper.execute_create_many('user', [{'name': 'user_%d' % i, 'age': i} for i in range(10)], commit=True)
+    assert DataBaseHelper.execute_update('user', {'age': 100}, {'id__in': [1, 2]}, commit=True) == 2
+
+    # Lists longer than the chunk size of the dialect are deduplicated and split across statements
+    monkeypatch.setitem(DataBaseHelper.in_chunk_sizes, 'sqlite', 3)
+    assert DataBaseHelper.execute_delete('user', {'id__in': [1, 2, 3, 3, 4, 5, 6, 7]}, commit=True) == 7
+    assert [row.id for row in DataBaseHelper.select_all('demo.user.select_ids')] == [8, 9, 10]
+
+
+def test_execute_update_many_matches_every_row_by_key(app):
+    DataBaseHelper.execute_create_many('user', [{'name': 'user_%d' % i, 'age': i} for i in range(5)], commit=True)
+    rows = [{'id': 1, 'age': 10}, {'id': 2, 'age': 20}, {'id': 3, 'name': 'c', 'age': 30}]
+    assert DataBaseHelper.execute_update_many('user', rows, chunk_size=1, commit=True) == 3
+    rows = DataBaseHelper.select_all('demo.user.select_ids')
+    assert [(row.name, row.age) for row in rows[:4]] == [('user_0', 10), ('user_1', 20), ('c', 30), ('user_3', 3)]
+    # A row without the key fails the whole call
+    assert DataBaseHelper.execute_update_many('user', [{'age': 1}], commit=True) is None
+
+
+def test_execute_upsert(app):
+    DataBaseHelper.execute_create_many('user', [{'name': 'a', 'age': 1}, {'name': 'b', 'age': 2}], commit=True)
+    DataBaseHelper.execute_upsert('user', [{'name': 'a', 'age': 10}, {'name': 'c', 'age': 3}], 'name', commit=True)
+    rows = DataBaseHelper.select_all('demo.user.select_ids')
+    assert [(row.name, row.age) for row in rows] == [('a', 10), ('b', 2), ('c', 3)]
+
+    # Without update fields the existing row is left untouched
+    DataBaseHelper.execute_upsert('user', [{'name': 'b', 'age': 20}], 'name', update_fields=[], commit=True)
+    assert DataBaseHelper.select_all('demo.user.select_ids')[1].age == 2
+
+
+def test_mysql_upsert_without_update_fields_assigns_the_key_to_itself():
+    dialect = mysql.dialect()
+    sql = DataBaseHelper.get_upsert_sql(dialect, 'user', ('name', 'age'), ['name'], [])
+    assert sql.endswith('ON DUPLICATE KEY UPDATE `name` = `name`')
+
+
+def test_buffered_trans_inserts_queued_rows_in_batches(app):
+    db = DataBaseHelper.db
+    with db.trans(buffered=True, buffer_size=3):
+        assert DataBaseHelper.execute_create('user', {'name': 'a', 'age': 1}, buffered=True) is True
+        # Unbuffered calls are inserted right away and still return the id, after the queued rows
+        assert DataBaseHelper.execute_create('user', {'name': 'b', 'age': 2}) == 2
+        for name in ('c', 'd', 'e'):
+            DataBaseHelper.execute_create('user', {'name': name, 'age': 3}, buffered=True)
+        # A read flushes the queue first
+        assert [row.name for row in DataBaseHelper.select_all('demo.user.select_ids')] == ['a', 'b', 'c', 'd', 'e']
+        DataBaseHelper.execute_create('user', {'name': 'f', 'age': 4}, buffered=True)
+    assert select_names() == ['a', 'b', 'c', 'd', 'e', 'f']
+    assert DataBaseHelper.insert_buffer_key not in db.session.info
+
+
+def test_nested_buffered_trans_keeps_the_outer_buffer(app):
+    db = DataBaseHelper.db
+    with db.trans(buffered=True):
+        DataBaseHelper.execute_create('user', {'name': 'a', 'age': 1}, buffered=True)
+        with db.trans(buffered=True):
+            DataBaseHelper.execute_create('user', {'name': 'b', 'age': 2}, buffered=True)
+        assert DataBaseHelper.execute_create('user', {'name': 'c', 'age': 3}, buffered=True) is True
+    assert select_names() == ['a', 'b', 'c']
+
+
+def test_failed_flush_raises_the_database_error(app):
+    db = DataBaseHelper.db
+    DataBaseHelper.execute_create('user', {'name': 'a', 'age': 1}, commit=True)
+    with pytest.raises(Exception) as info:
+        with db.trans(buffered=True):
+            DataBaseHelper.execute_create('user', {'name': 'a', 'age': 2}, buffered=True)
+    assert isinstance(info.value.__cause__, IntegrityError)
+    assert select_names() == ['a']